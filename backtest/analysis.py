@@ -185,4 +185,42 @@ def sharpe(returns, risk_free_rate, window):
     tmp = tmp.iloc[:,0] - tmp.iloc[:,1]
     tmp.name = returns.name
     
-    return tmp.rolling(window).mean() / tmp.rolling(window).std() * np.sqrt(252)
\ No newline at end of file
+    return tmp.rolling(window).mean() / tmp.rolling(window).std() * np.sqrt(252)
+
+def summary(backtest):
+    """
+    Calculates the key statistics of a backtest.
+
+    Parameters
+    ----------
+    backtest : Backtest
+        Backtest already run.
+
+    Returns
+    -------
+    dict
+        CAGR, annualized volatility, Sharpe ratio (over the risk free 
+        rate), maximum drawdown and annualized turnover (one way: half the
+        value traded, excluding the cash fund, over the average value).
+        
+    Note
+    ----
+    Annualized on a 252 business days year basis.
+    """
+    
+    value = backtest.value["eod"]
+    returns = value.pct_change().iloc[1:]
+    years = len(returns) / 252
+
+    risk_free_rate = backtest.risk_free_rate.reindex(value.index).fillna(method="pad")
+    excess = returns - risk_free_rate.iloc[1:]
+
+    orders = backtest.orders
+    traded = orders[(orders["status"] == "completed") & (orders["ticker"] != "CASH_FUND")]
+    traded = traded["value"].abs().sum()
+    
+    return {"cagr": (value.iloc[-1] / value.iloc[0]) ** (1 / years) - 1 if years else np.nan,
+            "volatility": returns.std() * np.sqrt(252),
+            "sharpe": excess.mean() / excess.std() * np.sqrt(252),
+            "max_drawdown": drawdown(value).min(),
+            "turnover": traded / 2 / value.mean() / years if years else np.nan}
@@ -1,4 +1,5 @@
 import os
+import pickle
 import datetime as dt
 import numpy as np
 import pandas as pd
@@ -7,15 +8,88 @@ from itertools import cycle
 import progressbar as pb
 
 from .definitions import (INSTANTS, RESULTS_DATA, SECTORS, MKT_PORTFOLIO)
+from .ledger import Ledger, BatchLedger
+from .book import OrderBook, ExpenseBook, BatchOrderBook, BatchExpenseBook
 
 # Loading bar widget
 widgets_run =  ['Running backtest       : ', pb.Percentage(), ' ', pb.Bar(marker=pb.RotatingMarker()), ' ', pb.ETA()]
 
 
+def fill_orders(liquidity, cost):
+    """Finds which orders of an auction are filled
+
+    Orders are executed in booking order and an order is rejected when
+    the liquidity left after the previous fills is not enough to pay for
+    it (liquidity - cost < 0). Runs of filled orders are found in a single
+    cumulative pass; the pass restarts only after a rejected order.
+
+    Parameters
+    ----------
+    liquidity : float
+        Cash plus cash fund value available before the auction
+    cost : numpy.ndarray
+        Cost of each order (value plus commission), in booking order
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask of the filled orders
+    """
+    filled = np.zeros(cost.size, dtype=bool)
+    start = 0
+    while start < cost.size:
+        remaining = liquidity - np.cumsum(cost[start:])
+        enough = remaining >= 0
+        if enough.all():
+            filled[start:] = True
+            break
+        rejected = np.argmin(enough)  # first order without enough cash
+        filled[start:start + rejected] = True
+        if rejected > 0:
+            liquidity = remaining[rejected - 1]
+        start += rejected + 1
+    return filled
+
+
+class AlignedLines(dict):
+    """
+    A class to hold the lines of a backtest as contiguous float64 arrays
+    aligned to its calendar (and tickers), read by day and ticker offsets.
+
+    A line missing from the mapping is aligned on its first access, so
+    only the lines read by the simulation are copied.
+
+
+    Attributes
+    ----------
+    align : callable
+        returns the aligned array of a line from its name
+    """
+
+    def __init__(self, align):
+        super().__init__()
+        self.align = align
+
+
+    def __missing__(self, name):
+        array = self.align(name)
+        self[name] = array
+        return array
+
+
+
 class Backtest():
     """
     A class to represent a backtest.
 
+    The simulation routines carry the portfolios along a leading axis of the
+    ledger arrays, positions (portfolios, tickers) and cash (portfolios,):
+    a backtest simulates a single portfolio and BatchBacktest runs the same
+    routines over the portfolios of several backtests. The strategy books
+    its orders through **allocate**, which are booked once its hook returns,
+    and does not read the portfolio state (ledgers and books), which is
+    handed to the backtest at the end of the simulation.
+
 
     Attributes
     ----------
@@ -27,12 +101,42 @@ class Backtest():
         number of long positions to allocate
     number_short : int
         number of short positions to allocate
+    record_instants : list
+        instants of the day recorded in the ledgers, besides "eod" 
+        (INSTANTS records the full intraday history, for debugging)
+    schedule : Schedule
+        rules of the days in which the strategy triggers, compiled once
+        into **triggers** (None triggers every day)
+    triggers : numpy.ndarray
+        boolean trigger array over the calendar
+    trigger : bool
+        whether the strategy triggers in the current day
+    state_attributes : tuple
+        names of the attributes holding the state of the strategy, saved
+        in the checkpoints (state derived from the data is recalculated)
+    first_day : int
+        first day simulated by the last run (0, or the first new day of
+        a resumed simulation)
+    price_lines : tuple
+        lines aligned before the simulation starts, the other lines are
+        aligned on their first access (see AlignedLines)
+    n_portfolios : int
+        number of portfolios simulated by the last run (the backtests of
+        its batch, or 1)
 
     Methods
     -------
     run():
         Runs the simulation
+    save_checkpoint(path=None):
+        Saves the end state of the simulation
+    resume(path=None):
+        Continues a simulation from its checkpoint over the new dates
     """
+
+    schedule = None
+    state_attributes = ()
+    price_lines = ("open", "close")
     
     def __init__(self, start, end, 
                  number_long, number_short,
@@ -40,7 +144,7 @@ class Backtest():
                  volume_floor,
                  pct_cdi, commission, fund_fees=0,
                  name="backtest", initial_date="2010-06-30",
-                 start_cash=10000000.0):
+                 start_cash=10000000.0, record_instants=("eod",)):
         
         self.__lines = dict()
         self.start = dt.date.fromisoformat(start)
@@ -75,16 +179,22 @@ class Backtest():
         
         self.instants = cycle(INSTANTS)
         self.instant = None
+        self.record_instants = record_instants
+        
+        self.triggers = None
+        self.trigger = False
         
         self.last_calendar_date = None
+        self.first_day = 0
                 
         self.zero = np.float64(0.0)
  
 
     def add_data(self, data):
+        # the lines of the data are fetched from it on their first access (see __getattr__), 
+        # so lines the strategy never reads are never opened
+        self.data = data
         self.tickers = data.tickers
-        lines = data.get_lines()
-        self.__lines.update(lines)
 
     def add_series(self, series):
         for key, value in series.items():
@@ -113,58 +223,40 @@ class Backtest():
         self.day = 0
         
             
-    def _create_support_ledgers(self):
+    def _create_support_ledgers(self, backtests=None):
+        # working ledgers of the portfolios simulated, along a leading portfolio axis: this
+        # backtest alone, or the backtests of a batch (see BatchBacktest), handed their own 
+        # ledgers and books by _split at the end
         # TODO: Improve this check
         if self.calendar.empty or self.tickers is None:
             raise AttributeError("Need to load assets and set a simulation calendar")
-        
-        instants = ["bod", "bod_adjusted", "post_open", "pre_close", "eod"]
-        column_index = pd.MultiIndex.from_product([instants, self.tickers], names=['intstants', 'ticker'])
-        
-        # Portfolio Value ledger - All day
-        self.value = pd.DataFrame(index=self.calendar, columns=instants, data=self.zero)
 
-        # Cash amount ledger - All day
-        self.cash = pd.DataFrame(index=self.calendar, columns=instants, data=self.zero)
+        self.backtests = [self] if backtests is None else list(backtests)
+        self.n_portfolios = len(self.backtests)
+        for backtest in self.backtests:
+            backtest._allocations = list()
 
-        # Cash flow support ledgers
-        self.injection = pd.Series(index=self.calendar, data=self.zero)
-        self.withdrawal = pd.Series(index=self.calendar, data=self.zero)
+        # Parameters of each portfolio
+        self.portfolio_commission = np.array([backtest.commission for backtest in self.backtests], 
+                                             dtype=np.float64)
+        self.portfolio_fund_fees_daily = np.array([backtest.fund_fees_daily for backtest in self.backtests])
+        self.portfolio_start_cash = np.array([backtest.start_cash for backtest in self.backtests])
         
-        # Assets & Cash Fund position ledgers - All day
-        self.position = pd.DataFrame(index=self.calendar, columns=column_index, data=self.zero)
-        self.cash_fund_position = pd.DataFrame(index=self.calendar, columns=instants, data=self.zero)
-
-        # Assets & Cash Fund value ledgers - end of day
-        self.position_value = pd.DataFrame(index=self.calendar, columns=self.tickers, data=self.zero)
-        self.cash_fund_value = pd.Series(index=self.calendar, data=self.zero, name="CASH_FUND")
-        self.value_long = pd.Series(index=self.calendar, data=self.zero, name="LONG_VALUE")
-        self.value_short = pd.Series(index=self.calendar, data=self.zero, name="SHORT_VALUE")
-        self.number_positions = pd.DataFrame(index=self.calendar, columns=["long", "short"], data=self.zero)
-
-        # Fund Fees Provisions - All day
-        self.fund_fees_provision = pd.DataFrame(index=self.calendar, columns=instants, data=self.zero)
+        # Portfolio Value, Cash, Assets & Cash Fund positions and Fund Fees Provisions 
+        # - end of day, and other recorded instants
+        self.ledger = BatchLedger(self.calendar, self.tickers, self.n_portfolios, self.record_instants)
         
-        # Corporate action ledgers
-        self.dividends = pd.DataFrame(index=self.calendar, columns=column_index, data=self.zero)
+        # Corporate action ledgers - sparse, day -> {ticker: cash amount of each portfolio}
+        self.dividends = dict()
         # TODO: Implement adjustments
-        #self.stock_dividend = pd.DataFrame(index=self.calendar, columns=column_index, data=0)
-        #self.m_and_a_payments = pd.DataFrame(index=self.calendar, columns=column_index, data=0)
-
-        # Metrics - end of day
-        self.net_exposure = pd.Series(index=self.calendar, data=self.zero)
-        self.gross_exposure = pd.Series(index=self.calendar, data=self.zero)
-        self.net_exposure_pct = pd.Series(index=self.calendar, data=self.zero)
-        self.gross_exposure_pct = pd.Series(index=self.calendar, data=self.zero)
+        #self.stock_dividend = dict()
+        #self.m_and_a_payments = dict()
         
         # Order Book ledger
-        order_columns = ["day", "date", "order_type", "ticker", "quantity", 
-                         "price", "value", "commission", "cost", "status", "purpose", "message"]
-        self.orders = pd.DataFrame(columns=order_columns)
+        self.order_book = BatchOrderBook(self.calendar, ticker=self.tickers + ["CASH_FUND"])
 
         # Fund Expenses ledger
-        expenses_columns = ["day", "date", "expense_type", "ticker", "value", "purpose"]
-        self.expenses = pd.DataFrame(columns=expenses_columns)
+        self.expense_book = BatchExpenseBook(self.calendar, ticker=self.tickers)
     
     
     def _next_instant(self):
@@ -183,12 +275,72 @@ class Backtest():
         self.cash_fund_nav = nav
 
 
-    def _loop_calendar(self):
+    def _align_lines(self):
+        # aligns the price lines and the cash fund nav to the calendar (and tickers) 
+        # as contiguous arrays, so the simulation loop reads them by day and ticker offsets
+        # (any other line read through the arrays is aligned on its first access)
+        self.arrays = AlignedLines(self._align_line)
+        for name in self.price_lines + ("cash_fund_nav",):
+            self.arrays[name] = self._align_line(name)
+
+
+    def _align_line(self, name):
+        try:
+            line = getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+        if isinstance(line, pd.DataFrame):
+            line = line.reindex(index=self.calendar, columns=self.tickers)
+        elif isinstance(line, pd.Series):
+            line = line.reindex(self.calendar)
+        else:
+            raise KeyError(name)
+        return np.ascontiguousarray(line.values, dtype=np.float64)
+
+
+    def _compile_schedule(self):
+        # compiles the schedule into the trigger array (every day if there is no schedule)
+        if self.schedule is None:
+            self.triggers = np.ones(self.calendar.size, dtype=bool)
+        else:
+            self.triggers = self.schedule.compile(self.calendar)
+
+
+    def strategy_days(self):
+        # days in which open_strategy or close_strategy may book orders
+        # the days in between are fast forwarded
+        return self.triggers
+
+
+    def _event_days(self):
+        # days that have to be simulated instant by instant, for any of the portfolios
+        events = np.array(self.strategy_days(), dtype=bool)
+        events[0] = True
+        events |= (self.ledger.injection != 0).any(axis=0) | (self.ledger.withdrawal != 0).any(axis=0)
+        for day in self.dividends:
+            events[day] = True
+        return np.flatnonzero(events)
+
+
+    def _loop_calendar(self, first=0):
         timer_run = pb.ProgressBar(widgets=widgets_run, maxval=self.calendar.size).start()
-            
-        for day, date in enumerate(self.calendar):
+        
+        events = self._event_days()
+        day = first
+        while day < self.calendar.size:
+            # fast forward to the next event day or day with orders to be executed
+            next_event = events[np.searchsorted(events, day)] if day <= events[-1] else self.calendar.size
+            next_orders = self.order_book.next_day(day)
+            if next_orders is not None:
+                next_event = min(next_event, next_orders)
+            if next_event > day and (self.ledger.cash == 0.0).all():
+                self._fast_forward(day, next_event)
+                day = next_event
+                timer_run.update(day - 1)
+                continue
+
             self.day = day
-            self.date = date
+            self.date = self.calendar[day]
             
             ### Instants to loop ###
             self._next_instant()
@@ -196,14 +348,14 @@ class Backtest():
             
             self._next_instant()
             self._bod_adjustments_routine() 
-            if self.day > 0: self.open_strategy()
+            if self.day > 0: self._strategies("open_strategy")
 
             self._next_instant()
             self._post_open_routine()
 
             self._next_instant()
             self._pre_close_routine()
-            if self.day > 0 and self.date < self.end_adj: self.close_strategy()
+            if self.day > 0 and self.date < self.end_adj: self._strategies("close_strategy")
 
             self._next_instant()
             self._eod_routine()
@@ -212,54 +364,197 @@ class Backtest():
             self.previous_date = self.date
 
             timer_run.update(day)
+            day += 1
 
         timer_run.finish()
+
+
+    def _fast_forward(self, start, end):
+        """
+        Simulates the days from start to end (exclusive) in one step
+
+        There are no orders and no strategy triggers in these days, so the
+        positions are constant and cash is zero: the portfolios are marked to 
+        market, the cash fund shares are valued by the cash fund nav, the daily 
+        fund fees provision is accrued and the provision is paid on the first 
+        day of each month, as the routines would do day by day. The scalars of 
+        the state are (portfolios, days) arrays.
+        """
+        days = np.arange(start, end)
+        position = self.ledger.position
+        held = np.flatnonzero(position.any(axis=0))
+        open_value = position[:, held].dot(np.nan_to_num(self.arrays["open"][start:end][:, held]).T)
+        close_value = position[:, held].dot(np.nan_to_num(self.arrays["close"][start:end][:, held]).T)
+        cash_fund_nav = self.arrays["cash_fund_nav"][start:end]
+        
+        shape = (self.n_portfolios, days.size)
+        state = {instant: {name: np.zeros(shape) for name in Ledger.scalars} for instant in INSTANTS}
+
+        # segments of days between the first days of the months
+        # (the first day of the calendar is always an event day, so start > 0)
+        month = self.calendar.month[start - 1:end]
+        month_start = np.flatnonzero(month[1:] != month[:-1])
+        bounds = np.unique(np.concatenate([[0], month_start, [days.size]]))
+        
+        f = self.portfolio_fund_fees_daily[:, None]
+        a = 1 - f
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            self.day = start + first
+            self.date = self.calendar[self.day]
+            segment = slice(first, last)
+
+            for instant in ("bod", "bod_adjusted"):
+                state[instant]["cash_fund_position"][:, first] = self.ledger.cash_fund_position
+                state[instant]["fund_fees_provision"][:, first] = self.ledger.fund_fees_provision
+                state[instant]["value"][:, first] = self.ledger.value
+
+            # Pay fund fees on the first day of the month
+            if first in month_start:
+                self._pay_fund_fees()
+
+            # Fund fees provision: provision = f * (value before provision), accrued daily
+            cash_fund_position = self.ledger.cash_fund_position[:, None]
+            fund_fees_provision = self.ledger.fund_fees_provision[:, None]
+            marked = close_value[:, segment] + cash_fund_position * cash_fund_nav[segment]
+            k = np.arange(last - first)
+            accrued = a**(k + 1) * (fund_fees_provision + f * np.cumsum(a**-(k + 1) * marked, axis=1))
+            provision_bod = np.concatenate([fund_fees_provision, accrued[:, :-1]], axis=1)
+            provision = f * (marked - provision_bod)
+
+            for instant in ("post_open", "pre_close"):
+                state[instant]["cash_fund_position"][:, segment] = cash_fund_position
+                state[instant]["fund_fees_provision"][:, segment] = provision_bod
+                state[instant]["value"][:, segment] = (open_value[:, segment] + cash_fund_position*cash_fund_nav[segment]
+                                                       - state[instant]["fund_fees_provision"][:, segment])
+            state["eod"]["cash_fund_position"][:, segment] = cash_fund_position
+            state["eod"]["fund_fees_provision"][:, segment] = accrued
+            state["eod"]["value"][:, segment] = marked - accrued
+
+            for instant in ("bod", "bod_adjusted"):
+                state[instant]["cash_fund_position"][:, first + 1:last] = cash_fund_position
+                state[instant]["fund_fees_provision"][:, first + 1:last] = accrued[:, :-1]
+                state[instant]["value"][:, first + 1:last] = state["eod"]["value"][:, first:last - 1]
+
+            self.ledger.fund_fees_provision = accrued[:, -1].copy()
+            self.ledger.value = state["eod"]["value"][:, last - 1].copy()
+            self.expense_book.extend((last - first) * self.n_portfolios,
+                                     day=np.repeat(days[segment], self.n_portfolios),
+                                     portfolio=np.tile(np.arange(self.n_portfolios), last - first),
+                                     expense_type="FUND_FEES", ticker=None,
+                                     value=provision.T.ravel(), purpose=None)
+
+        self.ledger.record_span(days, state)
+        self.day = end - 1
+        self.date = self.calendar[self.day]
+        self.previous_date = self.date
     
         
     def run(self):
         #self.set_calendar()
         self.get_cash_fund()
+        self._compile_schedule()
         self.calculate_support_index()
         
+        self._align_lines()
         self._create_support_ledgers()
+        self.first_day = 0
         self._loop_calendar()
+        self._split()
+
+
+    def save_checkpoint(self, path=None):
+        """
+        Saves the end state of the simulation, to be continued by **resume**
+
+        The checkpoint holds the ledgers (history and current positions,
+        cash, cash fund shares and fund fees provision), the order book with
+        the orders still registered, the expense book, the dividends, the
+        previous date and the **state_attributes** of the strategy.
+
+        Parameters
+        ----------
+        path : str, default : None
+            File of the checkpoint, default the results directory
+        """
+        path = path or os.path.join(RESULTS_DATA, self.name + ".ckpt")
+        state = {"calendar": self.calendar,
+                 "ledger": self.ledger,
+                 "order_book": self.order_book,
+                 "expense_book": self.expense_book,
+                 "dividends": self.dividends,
+                 "previous_date": self.previous_date,
+                 "strategy": {name: getattr(self, name) for name in self.state_attributes}}
+        with open(path, "wb") as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+    def resume(self, path=None):
+        """
+        Continues a finished simulation over the new dates of its data
+
+        Replaces **run** once the calendar is set: the support indexes are
+        calculated over the whole calendar, which must start with the
+        calendar of the checkpoint, the saved state is restored and only the
+        days after the last day of the checkpoint are simulated. The results
+        are the same as running the whole calendar again, as long as the
+        strategy books no orders in the closing auction of the last day of
+        the checkpoint (close_strategy does not run in the last day).
+
+        Parameters
+        ----------
+        path : str, default : None
+            File of the checkpoint, default the results directory
+        """
+        path = path or os.path.join(RESULTS_DATA, self.name + ".ckpt")
+        with open(path, "rb") as file:
+            state = pickle.load(file)
+
+        self.get_cash_fund()
+        self._compile_schedule()
+        self.calculate_support_index()
+        self._align_lines()
+
+        # the saved ledgers and books, moved to the new calendar and universe, as the working
+        # ledgers of a single portfolio
+        self._create_support_ledgers()
+        self.ledger = BatchLedger.join([state["ledger"].rebase(self.calendar, self.tickers)])
+        order_book = state["order_book"]
+        order_book.rebase(self.calendar, ticker=self.tickers + ["CASH_FUND"])
+        self.order_book = order_book.take(np.arange(order_book.size), BatchOrderBook)
+        expense_book = state["expense_book"]
+        expense_book.rebase(self.calendar, ticker=self.tickers)
+        self.expense_book = expense_book.take(np.arange(expense_book.size), BatchExpenseBook)
+        self.dividends = {day: {ticker: np.array([amount]) for ticker, amount in dividends.items()}
+                          for day, dividends in state["dividends"].items()}
+        self.previous_date = state["previous_date"]
+        for name, value in state["strategy"].items():
+            setattr(self, name, value)
+
+        self.first_day = len(state["calendar"])
+        self.day = self.first_day - 1
+        self.date = self.calendar[self.day]
+        self._loop_calendar(first=self.first_day)
+        self._split()
 
 
     def _bod_routine(self):
         # _bod_routine : equals previous day / zeroes open on first day
         if self.day == 0:
-            self.position.iloc[self.day].loc["bod", :] = self.zero
-            self.cash_fund_position.iloc[self.day].loc["bod"] = self.zero
-            self.cash.iloc[self.day].loc["bod"] = self.zero
-            self.fund_fees_provision.iloc[self.day].loc["bod"] = self.zero
-            self.value.iloc[self.day].loc["bod"] = self.zero
-            self.injection.iloc[self.day] = self.start_cash
-        else:
-            self.position.iloc[self.day].loc["bod"] = self.position.iloc[self.day - 1].loc["eod"].values
-            self.cash_fund_position.iloc[self.day].loc["bod"] = self.cash_fund_position.iloc[self.day - 1].loc["eod"]
-            self.cash.iloc[self.day].loc["bod"] = self.cash.iloc[self.day - 1].loc["eod"]
-            self.fund_fees_provision.iloc[self.day].loc["bod"] = self.fund_fees_provision.iloc[self.day - 1].loc["eod"]
-            self.value.iloc[self.day].loc["bod"] = self.value.iloc[self.day - 1].loc["eod"]
+            self.ledger.reset()
+            self.ledger.injection[:, self.day] = self.portfolio_start_cash
+        self.ledger.record(self.day, self.instant)
     
     
     def _bod_adjustments_routine(self):
         # _bod_adjustments_routine: bod_adjusted = bod + adjustments
         # TODO: implement adjustments for splits and others
-        self.position.iloc[self.day].loc["bod_adjusted"] = self.position.iloc[self.day].loc["bod"].values
-        self.cash_fund_position.iloc[self.day].loc["bod_adjusted"] = self.cash_fund_position.iloc[self.day].loc["bod"]
-        self.cash.iloc[self.day].loc["bod_adjusted"] = self.cash.iloc[self.day].loc["bod"]
-        self.fund_fees_provision.iloc[self.day].loc["bod_adjusted"] = self.fund_fees_provision.iloc[self.day].loc["bod"]
         # The value should not change due to adjustments, but may lack appropriate information for the calculation 
         # (e.g. M&A, when the holder receives shares of other companies the lack pricing information)
-        self.value.iloc[self.day].loc["bod_adjusted"] = self.value.iloc[self.day].loc["bod"]
+        self.ledger.record(self.day, self.instant)
         
         
     def _post_open_routine(self):
         # _post_open_routine: bod_adjusted + orders executed
-        self.position.iloc[self.day].loc["post_open"] = self.position.iloc[self.day].loc["bod_adjusted"].values
-        self.cash_fund_position.iloc[self.day].loc["post_open"] = self.cash_fund_position.iloc[self.day].loc["bod_adjusted"]
-        self.cash.iloc[self.day].loc["post_open"] = self.cash.iloc[self.day].loc["bod_adjusted"]
-        self.fund_fees_provision.iloc[self.day].loc["post_open"] = self.fund_fees_provision.iloc[self.day].loc["bod_adjusted"]
         
         # Execute orders and update positions and cash
         self._execute_orders(auction="open")
@@ -267,41 +562,42 @@ class Backtest():
         # Check if first day of month to pay fund fees and write down fund fee provision
         if self.day > 0:
             if self.date.month != self.previous_date.month:
-                fund_fees_provision = self.fund_fees_provision.iloc[self.day].loc["post_open"]
-                self.fund_fees_provision.iloc[self.day].loc["post_open"] = 0
+                self._pay_fund_fees()
+        
+        # Calculate the portfolio value
+        self.ledger.value = self.get_value("open")
+        self.ledger.record(self.day, self.instant)
 
-                cash, cash_fund_movement = self.calculate_cash_or_cash_fund_charge(fund_fees_provision)
 
-                # Update cash
-                self.cash.iloc[self.day].loc[self.instant] += cash
+    def _pay_fund_fees(self):
+        # pays the fund fees provision from cash and cash fund
+        fund_fees_provision = self.ledger.fund_fees_provision
+        self.ledger.fund_fees_provision = np.zeros(self.n_portfolios)
 
-                # Update cash fund positions
-                if cash_fund_movement != 0.0:
-                    # Book order and charge cash fund
-                    self.charge_cash_fund(cash_fund_movement)
-        
-        # Calculate the portfolio value
-        self.value.loc[self.date].loc["post_open"] = self.get_value("open")
+        cash, cash_fund_movement = self.calculate_cash_or_cash_fund_charge(fund_fees_provision)
+
+        # Update cash
+        self.ledger.cash += cash
+
+        # Update cash fund positions
+        # Book orders and charge cash fund
+        moved = np.flatnonzero(cash_fund_movement != 0.0)
+        self.charge_cash_fund(moved, cash_fund_movement[moved])
 
 
     def _pre_close_routine(self):
         # _pre_close_routine = post_open + cash/stock dividends + cash flow
-        self.position.iloc[self.day].loc["pre_close"] = self.position.iloc[self.day].loc["post_open"].values
-        self.cash_fund_position.iloc[self.day].loc["pre_close"] = self.cash_fund_position.iloc[self.day].loc["post_open"]
-        self.cash.iloc[self.day].loc["pre_close"] = self.cash.iloc[self.day].loc["post_open"]
-        self.fund_fees_provision.iloc[self.day].loc["pre_close"] = self.fund_fees_provision.iloc[self.day].loc["post_open"]
-        
-        injection = self.injection.iloc[self.day]
-        dividends = self.dividends.iloc[self.day]
-        withdrawal = self.withdrawal.iloc[self.day]
-        cash_flow = + injection + dividends.sum() - withdrawal
-        cash_position = self.cash.iloc[self.day].loc["pre_close"]
+        injection = self.ledger.injection[:, self.day]
+        dividends = self.dividends.get(self.day, {})
+        withdrawal = self.ledger.withdrawal[:, self.day]
+        cash_flow = + injection + sum(dividends.values()) - withdrawal
 
         # Update cash with daily cash flow
-        self.cash.iloc[self.day].loc["pre_close"] = cash_position + cash_flow
+        self.ledger.cash += cash_flow
 
         # Calculate the portfolio value
-        self.value.iloc[self.day].loc["pre_close"] = self.get_value("open")
+        self.ledger.value = self.get_value("open")
+        self.ledger.record(self.day, self.instant)
         
         # if last day, book orders to close all positions
         #if self.date==self.end_adj:
@@ -310,161 +606,235 @@ class Backtest():
 
     def _eod_routine(self):
         # _eod_routine = pre_close + trades executed on closing auction
-        self.position.iloc[self.day].loc["eod"] = self.position.iloc[self.day].loc["pre_close"].values
-        self.cash_fund_position.iloc[self.day].loc["eod"] = self.cash_fund_position.iloc[self.day].loc["pre_close"]
-        self.cash.iloc[self.day].loc["eod"] = self.cash.iloc[self.day].loc["pre_close"]
-        self.fund_fees_provision.iloc[self.day].loc["eod"] = self.fund_fees_provision.iloc[self.day].loc["pre_close"]
         
         # Execute orders and update positions and cash
         self._execute_orders(auction="close")
 
         # Calculate Fund Fee provision over last value and register provision expense
         value = self.get_value("close")
-        provision = value * self.fund_fees_daily
-        self.fund_fees_provision.iloc[self.day].loc["eod"] += provision
+        provision = value * self.portfolio_fund_fees_daily
+        self.ledger.fund_fees_provision += provision
 
-        self.register_expense(self.day, self.date, "FUND_FEES", None, provision, None)
+        self.expense_book.extend(self.n_portfolios, day=self.day, portfolio=np.arange(self.n_portfolios),
+                                 expense_type="FUND_FEES", ticker=None, value=provision, purpose=None)
 
         # Update value to reflect provision
-        self.value.iloc[self.day].loc["eod"] = self.get_value("close")
+        self.ledger.value = self.get_value("close")
+        self.ledger.record(self.day, self.instant)
 
-        # Support metrics
-        prices = self.close.loc[self.date].fillna(0)
-        positions = self.position.loc[self.date].loc["eod"].fillna(0)
-        position_value = prices * positions
-        self.position_value.loc[self.date] = position_value
 
-        cash_fund_nav = self.cash_fund_nav.loc[self.date]
-        cash_fund_position = self.cash_fund_position.loc[self.date].loc["eod"]
+    def _calculate_eod_metrics(self):
+        # Support metrics - end of day, over the whole calendar
+        # (only the tickers held each day are visited)
+        eod = self.ledger.instant_index["eod"]
+        days, tickers, positions = self.ledger.holdings.select(self.ledger.rows("eod"))
+        position_value = np.nan_to_num(self.arrays["close"][days, tickers]) * positions
+
+        cash_fund_nav = self.arrays["cash_fund_nav"]
+        cash_fund_position = self.ledger.history["cash_fund_position"][:, eod]
         cash_fund_value = cash_fund_nav * cash_fund_position
-        self.cash_fund_value.iloc[self.day] = cash_fund_value
+        self.cash_fund_value = pd.Series(index=self.calendar, data=cash_fund_value, name="CASH_FUND")
 
-        self.value_long.iloc[self.day] = position_value[position_value > 0].sum()
-        self.value_short.iloc[self.day] = position_value[position_value < 0].sum()
-        self.number_positions.iloc[self.day].loc["long"] = positions[positions > 0].count()
-        self.number_positions.iloc[self.day].loc["short"] = positions[positions < 0].count()
-        self.net_exposure.iloc[self.day] = self.value_long.iloc[self.day] + self.value_short.iloc[self.day]
-        self.gross_exposure.iloc[self.day] = self.value_long.iloc[self.day] - self.value_short.iloc[self.day]
-        self.net_exposure_pct.iloc[self.day] = self.net_exposure.iloc[self.day] / value
-        self.gross_exposure_pct.iloc[self.day] = self.gross_exposure.iloc[self.day] / value
+        size = self.calendar.size
+        value_long = np.bincount(days, weights=np.where(position_value > 0, position_value, self.zero), minlength=size)
+        value_short = np.bincount(days, weights=np.where(position_value < 0, position_value, self.zero), minlength=size)
+        self.value_long = pd.Series(index=self.calendar, data=value_long, name="LONG_VALUE")
+        self.value_short = pd.Series(index=self.calendar, data=value_short, name="SHORT_VALUE")
+        
+        number_positions = np.stack([np.bincount(days[positions > 0], minlength=size), 
+                                     np.bincount(days[positions < 0], minlength=size)], axis=1)
+        self.number_positions = pd.DataFrame(index=self.calendar, columns=["long", "short"], 
+                                             data=number_positions.astype(np.float64))
+
+        # exposures are relative to the value before the day's fund fees provision
+        value = self.ledger.history["value"][:, eod] / (1 - self.fund_fees_daily)
+        net_exposure = value_long + value_short
+        gross_exposure = value_long - value_short
+        self.net_exposure = pd.Series(index=self.calendar, data=net_exposure)
+        self.gross_exposure = pd.Series(index=self.calendar, data=gross_exposure)
+        self.net_exposure_pct = pd.Series(index=self.calendar, data=net_exposure / value)
+        self.gross_exposure_pct = pd.Series(index=self.calendar, data=gross_exposure / value)
+
+
+    def _split(self):
+        # hands each backtest simulated its ledgers and books, as if it had been run alone
+        ledger, order_book, expense_book = self.ledger, self.order_book, self.expense_book
+        orders = order_book.column("portfolio")
+        expenses = expense_book.column("portfolio")
+        backtests = self.backtests
+        del self.backtests
+        for k, backtest in enumerate(backtests):
+            backtest.ledger = ledger.split(k)
+            backtest.order_book = order_book.take(np.flatnonzero(orders == k), OrderBook)
+            backtest.expense_book = expense_book.take(np.flatnonzero(expenses == k), ExpenseBook)
+            backtest.dividends = {day: {ticker: amount[k] for ticker, amount in dividends.items()}
+                                  for day, dividends in self.dividends.items()}
+            backtest.day = self.day
+            backtest.date = self.date
+            backtest.previous_date = self.previous_date
+            backtest._calculate_eod_metrics()
 
 
     def get_positions(self, long=True):
+        # positions of the simulation, once it has finished
+        held = self.ledger.held
         if long:
-            fltr = self.position[self.instant].iloc[self.day] > 0
+            fltr = self.ledger.position[held] > 0
         else:
-            fltr = self.position[self.instant].iloc[self.day] < 0
-        return self.position[self.instant].iloc[self.day].loc[fltr].index
+            fltr = self.ledger.position[held] < 0
+        return pd.Index([self.tickers[i] for i in held[fltr]], name="ticker", dtype=object)
 
     
     def get_value(self, price_reference):
-        if price_reference == "open":
-            prices = self.open.loc[self.date].fillna(0)
-        elif price_reference == "close":
-            prices = self.close.loc[self.date].fillna(0)
-        
-        positions = self.position.loc[self.date].loc[self.instant]
-        cash_fund_nav = self.cash_fund_nav.loc[self.date]
-        cash_fund_position = self.cash_fund_position.loc[self.date].loc[self.instant]
-        cash_fund_value = cash_fund_nav * cash_fund_position
-        cash = self.cash.loc[self.date].loc[self.instant]
-        fund_fees_provision = self.fund_fees_provision.loc[self.date].loc[self.instant]
-        value = prices.dot(positions) + cash_fund_value + cash - fund_fees_provision
+        # value of each portfolio
+        position = self.ledger.position
+        held = np.flatnonzero(position.any(axis=0))
+        prices = np.nan_to_num(self.arrays[price_reference][self.day, held])
+        
+        cash_fund_nav = self.arrays["cash_fund_nav"][self.day]
+        cash_fund_value = cash_fund_nav * self.ledger.cash_fund_position
+        cash = self.ledger.cash
+        fund_fees_provision = self.ledger.fund_fees_provision
+        value = position[:, held].dot(prices) + cash_fund_value + cash - fund_fees_provision
         return value
 
 
-    def charge_cash_fund(self, quantity):
-        cash_fund_nav = self.cash_fund_nav.loc[self.date]
+    def charge_cash_fund(self, portfolios, quantity):
+        cash_fund_nav = self.arrays["cash_fund_nav"][self.day]
         value = cash_fund_nav * quantity
-        cash_fund_order = {
-            "day": self.day, 
-            "date": self.date,
-            "order_type": "buy" if quantity > 0 else "sell",
-            "ticker": "CASH_FUND",
-            "quantity": quantity,
-            "price": cash_fund_nav,
-            "value": value,
-            "commission": 0.0,
-            "cost": value - 0.0,
-            "status": "completed",
-            "purpose": "cash movement",
-        }
-        self.orders = self.orders.append(cash_fund_order, ignore_index=True)
+        self.order_book.extend(len(portfolios),
+                               day=self.day,
+                               portfolio=portfolios,
+                               order_type=np.where(quantity > 0, "buy", "sell").astype(object),
+                               ticker="CASH_FUND",
+                               quantity=quantity,
+                               price=cash_fund_nav,
+                               value=value,
+                               commission=0.0,
+                               cost=value - 0.0,
+                               status="completed",
+                               purpose="cash movement")
         # Update cash fund positions
-        self.cash_fund_position.iloc[self.day].loc[self.instant] += quantity
+        self.ledger.cash_fund_position[portfolios] += quantity
 
 
     def calculate_cash_or_cash_fund_charge(self, amount):
-        cash_fund_nav = self.cash_fund_nav.loc[self.date]
-        cash_value = self.cash.iloc[self.day].loc[self.instant]
-        cash_fund_position = self.cash_fund_position.iloc[self.day].loc[self.instant]
+        # charges of each portfolio, nothing is charged to a portfolio without enough liquidity
+        cash_fund_nav = self.arrays["cash_fund_nav"][self.day]
+        cash_value = self.ledger.cash
+        cash_fund_position = self.ledger.cash_fund_position
         liquidity = cash_value + cash_fund_position*cash_fund_nav
         
-        if liquidity - amount >= 0:
-            cash_to_charge = max([-min([cash_value, amount]), -amount]) # charge cash as much as possible
-            cash_fund_to_charge = - amount - cash_to_charge # charge difference to cash fund
-            cash_fund_position_to_charge = cash_fund_to_charge/cash_fund_nav
-            return cash_to_charge, cash_fund_position_to_charge
-        else:
+        enough = liquidity - amount >= 0
+        if not enough.all():
             print("Not enough cash!!!")
-            return False, False
+        cash_to_charge = np.maximum(-np.minimum(cash_value, amount), -amount) # charge cash as much as possible
+        cash_fund_to_charge = - amount - cash_to_charge # charge difference to cash fund
+        cash_fund_position_to_charge = cash_fund_to_charge/cash_fund_nav
+        return np.where(enough, cash_to_charge, 0.0), np.where(enough, cash_fund_position_to_charge, 0.0)
 
 
 
     def allocate(self, long, short):
-        long_positions = self.get_positions(long=True)
-        short_positions = self.get_positions(long=False)
-
-        long = dict(long)
-        short = dict(short)
-        
-        # 1) Close long positions
-        for d in (d for d in long_positions if d not in long.keys()):
-            self.order_target_percent(ticker=d, 
-                                      target=0.0, 
-                                      price_reference="open", 
-                                      price_offset=0, 
-                                      purpose="close long")
-        
-        # 2) Enter short positions
-        for d in (d for d in short.keys() if d not in short_positions):
-            self.order_target_percent(ticker=d, 
-                                      target=short[d], 
-                                      price_reference="open", 
-                                      price_offset=0, 
-                                      purpose="enter short")
-            
-        # 3) Rebalance short positions
-        for d in (d for d in short_positions if d in short.keys()):
-            self.order_target_percent(ticker=d, 
-                                      target=short[d],
-                                      price_reference="open", 
-                                      price_offset=0, 
-                                      purpose="rebalance short")
-
-        # 4) Rebalance long positions
-        for d in (d for d in long_positions if d in long.keys()):
-            self.order_target_percent(ticker=d, 
-                                      target=long[d], 
-                                      price_reference="open", 
-                                      price_offset=0, 
-                                      purpose="rebalance long")
-            
-        # 5) Close short positions   
-        for d in (d for d in short_positions if d not in short.keys()):
-            self.order_target_percent(ticker=d, 
-                                      target=0.0, 
-                                      price_reference="open", 
-                                      price_offset=0, 
-                                      purpose="close short")
-         
-        # 6) Enter long positions
-        for d in (d for d in long.keys() if d not in long_positions):
-            self.order_target_percent(ticker=d, 
-                                      target=long[d], 
-                                      price_reference="open", 
-                                      price_offset=0, 
-                                      purpose="enter long")
+        # long and short are lists of (ticker, target percentage), booked once the strategy 
+        # hook returns (see _strategies)
+        self._allocations.append((dict(long), dict(short)))
+
+
+    def _strategies(self, hook):
+        # runs a strategy hook of every backtest simulated and books their allocations together
+        # (the n-th allocation of each backtest is booked in the n-th round)
+        for backtest in self.backtests:
+            backtest.day = self.day
+            backtest.date = self.date
+            backtest.previous_date = self.previous_date
+            backtest.instant = self.instant
+            backtest.trigger = self.triggers[self.day]
+            getattr(backtest, hook)()
+
+        allocations = [backtest._allocations for backtest in self.backtests]
+        rounds = max(len(allocation) for allocation in allocations)
+        for i in range(rounds):
+            portfolios = [k for k, allocation in enumerate(allocations) if len(allocation) > i]
+            self.allocate_targets(np.array(portfolios), [allocations[k][i] for k in portfolios])
+        for allocation in allocations:
+            allocation.clear()
+
+
+    def _targets(self, targets):
+        # (tickers, targets, mask) of the union of the target dicts of each portfolio, or None
+        # when the union can not keep the order of every dict
+        columns = dict()
+        for target in targets:
+            for ticker in target:
+                columns.setdefault(ticker, len(columns))
+        for target in targets:
+            order = [columns[ticker] for ticker in target]
+            if any(i >= j for i, j in zip(order[:-1], order[1:])):
+                return None
+
+        tickers = np.array([self.ledger.ticker_index[ticker] for ticker in columns], dtype=np.int64)
+        values = np.zeros((len(targets), len(columns)))
+        mask = np.zeros((len(targets), len(columns)), dtype=bool)
+        for i, target in enumerate(targets):
+            j = [columns[ticker] for ticker in target]
+            values[i, j] = list(target.values())
+            mask[i, j] = True
+        return tickers, values, mask
+
+
+    def allocate_targets(self, portfolios, allocations, price_reference="open", price_offset=0):
+        """
+        Books the orders to take the portfolios to their target percentages
+
+        Orders are booked in the following order, so that cash is freed before 
+        it is used: close long, enter short, rebalance short, rebalance long, 
+        close short and enter long. Positions are entered in the order given.
+
+        Parameters
+        ----------
+        portfolios : numpy.ndarray
+            Offsets of the portfolios
+        allocations : list
+            (long, short) dicts of ticker: target percentage of each portfolio
+        """
+        long = self._targets([allocation[0] for allocation in allocations])
+        short = self._targets([allocation[1] for allocation in allocations])
+        if long is None or short is None:
+            # the portfolios do not share the order of their targets, books them one by one
+            for portfolio, allocation in zip(portfolios, allocations):
+                self.allocate_targets(np.array([portfolio]), [allocation], price_reference, price_offset)
+            return
+        long_tickers, long_targets, long_mask = long
+        short_tickers, short_targets, short_mask = short
+
+        position = self.ledger.position[portfolios]
+        held_long = position > 0
+        held_short = position < 0
+        shape = position.shape
+        in_long, in_short = np.zeros(shape, dtype=bool), np.zeros(shape, dtype=bool)
+        long_target, short_target = np.zeros(shape), np.zeros(shape)
+        in_long[:, long_tickers] = long_mask
+        long_target[:, long_tickers] = long_targets
+        in_short[:, short_tickers] = short_mask
+        short_target[:, short_tickers] = short_targets
+
+        def held(mask, target):
+            # tickers held in ascending order
+            tickers = np.flatnonzero(mask.any(axis=0))
+            return tickers, target[:, tickers], mask[:, tickers]
+
+        zeros = np.zeros(shape)
+        allocation = [(*held(held_long & ~in_long, zeros), "close long"),
+                      (short_tickers, short_targets, short_mask & ~held_short[:, short_tickers], "enter short"),
+                      (*held(held_short & in_short, short_target), "rebalance short"),
+                      (*held(held_long & in_long, long_target), "rebalance long"),
+                      (*held(held_short & ~in_short, zeros), "close short"),
+                      (long_tickers, long_targets, long_mask & ~held_long[:, long_tickers], "enter long")]
+
+        for tickers, targets, mask, purpose in allocation:
+            self.order_target_percents(portfolios, tickers, targets, mask,
+                                       price_reference, price_offset, purpose)
         
         
     def open_strategy(self):
@@ -482,156 +852,126 @@ class Backtest():
         # if opening auction, use open prices as reference;
         # or use close prices otherwise
         if auction == "open":
-            prices = self.open.loc[self.date]
+            prices = self.arrays["open"][self.day]
         elif auction == "close":
-            prices = self.close.loc[self.date]
+            prices = self.arrays["close"][self.day]
 
         # Cash fund nav reference is always from the previous day
-        cash_fund_nav = self.cash_fund_nav.loc[self.date]
-
-        # net number of cash fund shares to buy/sell
-        cash_fund_movement = 0.0
-
-        # filter then loop through order book for orders 
-        # (i) valid on the current day and 
-        # (ii) with status = registered
-        order_filter = (self.orders["day"]==self.day) & (self.orders["status"]=="registered")
-        orders = self.orders[order_filter].copy()
-        
-        for idx, order in orders.iterrows():
-            ticker = order.ticker
-            quantity = order.quantity
-            order_price = prices[ticker]
-            value = quantity * order_price
-            commission = abs(value) * self.commission
-            cost = value + commission
-            #print("ORDER TO BE EXECUTED: ticker {}, quantity {}, price {}".format(ticker, quantity, order_price))
-
-            # Calculates current liquidity position
-            cash_value = self.cash.iloc[self.day].loc[self.instant]
-            cash_fund_position = self.cash_fund_position.iloc[self.day].loc[self.instant]
-            liquidity = cash_value + (cash_fund_position+cash_fund_movement)*cash_fund_nav
-
-            # check if enough cash
-            resulting_cash = liquidity - cost
-            
-            if resulting_cash >= 0:
-                # Charge the cash and cash fund for the order...
-                cash_charged = max([-min([cash_value,cost]),-cost]) # charge cash as much as possible
-                cash_fund_charged = - cost - cash_charged # charge difference to cash fund
-
-                self.cash.iloc[self.day].loc[self.instant] += cash_charged
-                cash_fund_movement += cash_fund_charged/cash_fund_nav
+        cash_fund_nav = self.arrays["cash_fund_nav"][self.day]
+
+        # orders of all the portfolios for the current day and auction, in booking order
+        # (ticker codes of the order book are the ledger ticker offsets)
+        book = self.order_book
+        rows = book.pop(self.day, auction)
+        portfolios = book.column("portfolio")[rows]
+        tickers = book.column("ticker")[rows]
+        quantity = book.column("quantity")[rows]
+        order_price = prices[tickers]
+        value = quantity * order_price
+        commission = np.abs(value) * self.portfolio_commission[portfolios]
+        cost = value + commission
+
+        # Current liquidity position: cash plus cash fund
+        # each portfolio fills its orders with its own liquidity
+        cash_value = self.ledger.cash
+        liquidity = cash_value + self.ledger.cash_fund_position*cash_fund_nav
+        filled = np.zeros(rows.size, dtype=bool)
+        spent = np.zeros(self.n_portfolios)
+        for portfolio in np.unique(portfolios).tolist():
+            orders = np.flatnonzero(portfolios == portfolio)
+            filled[orders] = fill_orders(liquidity[portfolio], cost[orders])
+            spent[portfolio] = cost[orders][filled[orders]].sum()
+
+        # Update positions 
+        self.ledger.trade(portfolios[filled], tickers[filled], quantity[filled])
+
+        # Update orders
+        book.fill(rows[filled], value=value[filled], commission=commission[filled], 
+                  cost=cost[filled], price=order_price[filled])
+        book.reject(rows[~filled], "not enough cash to complete")
+
+        # Register expenses
+        self.expense_book.extend(filled.sum(), 
+                                 day=self.day,
+                                 portfolio=portfolios[filled],
+                                 expense_type="COMMISSION", 
+                                 ticker=tickers[filled], 
+                                 value=commission[filled], 
+                                 purpose=book.codes["purpose"].decode(book.column("purpose")[rows[filled]]))
         
-                # Update positions 
-                self.position.iloc[self.day].loc[self.instant, ticker] += quantity
-                
-                # Update orders
-                self.orders.loc[idx, "status"] = "completed"
-                self.orders.loc[idx, "value"] = value
-                self.orders.loc[idx, "commission"] = commission
-                self.orders.loc[idx, "cost"] = cost
-                self.orders.loc[idx, "price"] = order_price
-
-                # Register expenses
-                self.register_expense(self.day, self.date, 
-                                      "COMMISSION", ticker, 
-                                      commission, order.purpose)
-                
-            else:
-                self.orders.loc[idx, "status"] = "not completed"
-                self.orders.loc[idx, "message"] = "not enough cash to complete"        
-        
-        # After all orders have been processed, book cash fund movement
-        cash_value = self.cash.iloc[self.day].loc[self.instant]
-        self.cash.iloc[self.day].loc[self.instant] = cash_value - cash_value
-        cash_fund_movement += cash_value/cash_fund_nav
+        # After all orders have been processed, sweep the remaining cash to the cash fund
+        # (orders are charged to cash as much as possible and the difference to the cash fund)
+        self.ledger.cash = cash_value - cash_value
+        cash_fund_movement = (cash_value - spent)/cash_fund_nav
         cash_fund_movement_value = cash_fund_movement * cash_fund_nav
 
         # Update cash fund positions
-        self.cash_fund_position.iloc[self.day].loc[self.instant] += cash_fund_movement
-
-        if cash_fund_movement != 0.0:
-            # Book cash fund order
-            cash_fund_order = {
-                "day": self.day, 
-                "date": self.date,
-                "order_type": "buy" if cash_fund_movement > 0 else "sell",
-                "ticker": "CASH_FUND",
-                "quantity": cash_fund_movement,
-                "price": cash_fund_nav,
-                "value": cash_fund_movement_value,
-                "commission": 0.0,
-                "cost": cash_fund_movement_value - 0.0,
-                "status": "completed",
-                "purpose": "cash movement",
-            }
-            self.orders = self.orders.append(cash_fund_order, ignore_index=True)
+        self.ledger.cash_fund_position = self.ledger.cash_fund_position + cash_fund_movement
+
+        # Book cash fund orders
+        moved = np.flatnonzero(cash_fund_movement != 0.0)
+        book.extend(moved.size,
+                    day=self.day,
+                    portfolio=moved,
+                    order_type=np.where(cash_fund_movement[moved] > 0, "buy", "sell").astype(object),
+                    ticker="CASH_FUND",
+                    quantity=cash_fund_movement[moved],
+                    price=cash_fund_nav,
+                    value=cash_fund_movement_value[moved],
+                    commission=0.0,
+                    cost=cash_fund_movement_value[moved] - 0.0,
+                    status="completed",
+                    purpose="cash movement")
+
+
+    def order_target_percents(self, portfolios, tickers, targets, mask, price_reference, price_offset, purpose):
+        # books the orders of the (portfolios, tickers) in mask, tickers are position ledger offsets
+        day = self.day + price_offset
+        reference_price = self.arrays[price_reference][day, tickers]
         
-
-    
-    def order_target_percent(self, ticker, target, price_reference, price_offset, purpose):
-        prices = getattr(self, price_reference)
-        
-        price_day = prices.index.get_loc(self.date)
-        reference_price = prices.iloc[price_day + price_offset].loc[ticker]
-        
-        current_position = self.position.iloc[self.day].loc[self.instant, ticker]
+        current_position = self.ledger.position[portfolios[:, None], tickers]
         # Need to add previously booked orders that were not yet executed
-        c_date = self.orders.date==self.date
-        c_ticker = self.orders.ticker==ticker
-        c_status = self.orders.status=="registered"
-        registered_position = self.orders[c_date & c_ticker & c_status].quantity.sum()
+        registered_position = self.order_book.pending_quantities(self.day, portfolios, tickers)
 
         adjusted_position = current_position + registered_position
 
         reference_value = reference_price * adjusted_position
         
-        portfolio_value = self.value.iloc[self.day].loc[self.instant]
-        current_pct = reference_value / portfolio_value
-
-        if abs(target) == 0.0:
-            order_quantity = -adjusted_position
-            if adjusted_position > 0:
-                order_type = "sell"
-            elif adjusted_position < 0:
-                order_type = "buy"
-            else:
-                order_type = None
-        else:
-            delta_pct = target - current_pct
-            delta_position = delta_pct * portfolio_value / reference_price
-            delta_position_adjusted = divmod(abs(delta_position),100)[0] * 100
-            order_quantity = delta_position_adjusted if delta_position > 0 else -delta_position_adjusted
-            order_type = "buy" if delta_position > 0 else "sell"
+        portfolio_value = self.ledger.value[portfolios][:, None]
 
-        if order_quantity == 0.0:
-            return
-        
-        order = {"day": self.day + price_offset, 
-                 "date": self.calendar[self.day + price_offset],
-                 "purpose": purpose,
-                 "order_type": order_type,  
-                 "ticker": ticker,  
-                 "quantity": order_quantity,  
-                 "status": "registered"}
-        
-        self.orders = self.orders.append(order, ignore_index=True)
-
-
-    def register_expense(self, day, date, expense_type, ticker, value, purpose):
-        expense = {
-            "day": day,
-            "date": date,
-            "expense_type": expense_type,
-            "ticker": ticker,
-            "value": value,
-            "purpose": purpose}
-
-        self.expenses = self.expenses.append(expense, ignore_index=True)
-
-    
-    def _generate_analytics(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            current_pct = reference_value / portfolio_value
+            delta_pct = targets - current_pct
+            delta_position = delta_pct * portfolio_value / reference_price
+        delta_position_adjusted = np.floor_divide(np.abs(delta_position), 100) * 100
+        order_quantity = np.where(delta_position > 0, delta_position_adjusted, -delta_position_adjusted)
+        order_type = np.where(delta_position > 0, "buy", "sell").astype(object)
+
+        close = np.abs(targets) == 0.0
+        order_quantity[close] = -adjusted_position[close]
+        order_type[close & (adjusted_position > 0)] = "sell"
+        order_type[close & (adjusted_position < 0)] = "buy"
+        order_type[close & (adjusted_position == 0)] = None
+
+        to_book = mask & (order_quantity != 0.0)
+        rows, columns = np.nonzero(to_book)
+        self.order_book.register(day, self._auction(day), rows.size,
+                                 portfolio=portfolios[rows],
+                                 purpose=purpose,
+                                 order_type=order_type[to_book],
+                                 ticker=tickers[columns],
+                                 quantity=order_quantity[to_book])
+
+
+    def _auction(self, day):
+        # next auction in which an order for the given day can be executed
+        if day == self.day and INSTANTS.index(self.instant) >= INSTANTS.index("post_open"):
+            return "close"
+        return "open"
+
+
+    def _generate_analytics(self, first_date=None):
+        # first_date: attribution by type of position is calculated from this date on
         # returns
         tmp = self.value["eod"].pct_change(1).fillna(0)
         tmp.name = self.name
@@ -699,6 +1039,8 @@ class Backtest():
         attribution_position = pd.DataFrame(index=tmp.index, columns=["LONG", "SHORT"], data=0.0)
         attribution_position[other_cols] = tmp[other_cols]
         tmp = tmp.drop(columns=other_cols, axis=1)
+        if first_date is not None:
+            tmp = tmp.loc[first_date:]
         for date, row in tmp.iterrows():
             position_date = position.loc[date]
             long_position = position_date[position_date >= 0]
@@ -709,9 +1051,18 @@ class Backtest():
 
     
     def save_results(self):
-        self._generate_analytics() # generate analytics for the results
-
         path = os.path.join(RESULTS_DATA, self.name + ".h5")
+
+        # a resumed simulation appends the attribution by type of position of the new dates
+        # to the saved one, the other results are written from the ledgers (whole history)
+        first_date = None
+        if 0 < self.first_day < self.calendar.size and os.path.exists(path):
+            first_date = self.calendar[self.first_day]
+        self._generate_analytics(first_date) # generate analytics for the results
+        if first_date is not None:
+            saved = pd.read_hdf(path, 'attribution_position')
+            self.attribution_position = pd.concat([saved.loc[saved.index < first_date],
+                                                   self.attribution_position.loc[first_date:]])
         
         # save files to HD5 format
         self.returns.to_hdf(path, 'returns')
@@ -739,10 +1090,80 @@ class Backtest():
         self.nav.name = self.name
         self.nav.to_hdf(path, 'nav')
 
+        self.save_checkpoint()
+
+
+    @property
+    def position(self):
+        return self.ledger.frame("position")
+
+    @property
+    def cash(self):
+        return self.ledger.frame("cash")
+
+    @property
+    def cash_fund_position(self):
+        return self.ledger.frame("cash_fund_position")
+
+    @property
+    def fund_fees_provision(self):
+        return self.ledger.frame("fund_fees_provision")
+
+    @property
+    def value(self):
+        return self.ledger.frame("value")
+
+    @property
+    def position_value(self):
+        # Assets value ledger - end of day
+        prices = self.close.reindex(index=self.calendar, columns=self.tickers).values
+        data = np.nan_to_num(prices.astype(np.float64)) * self.ledger.positions("eod")
+        return pd.DataFrame(index=self.calendar, columns=self.tickers, data=data)
+
+    @property
+    def orders(self):
+        return self.order_book.frame()
+
+    @property
+    def expenses(self):
+        return self.expense_book.frame()
+
+    @property
+    def injection(self):
+        return self.ledger.frame("injection")
+
+    @property
+    def withdrawal(self):
+        return self.ledger.frame("withdrawal")
+
+
+    def __getstate__(self):
+        # pickles the simulation without the data, attached again with add_data and add_series
+        state = self.__dict__.copy()
+        state["_Backtest__lines"] = dict()
+        state["instants"] = None
+        state.pop("data", None)
+        state.pop("arrays", None)
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.instants = cycle(INSTANTS)
+
 
     def __getattr__(self, name):
+        # the series lines, then the lines of the data (private names are never lines, 
+        # see CSVData.__getattr__)
         try:
-            return self.__lines[name]
+            if name.startswith("_"):
+                raise KeyError(name)
+            if name in self.__lines:
+                return self.__lines[name]
+            data = self.__dict__.get("data")
+            if data is None:
+                raise KeyError(name)
+            return data.get_line(name)
         except KeyError:
             msg = "'{0}' object has no attribute '{1}'"
             raise AttributeError(msg.format(type(self).__name__, name))
@@ -0,0 +1,71 @@
+# parameters which may differ across the portfolios of a batch
+BATCHED = ["name", "target_long", "target_short", "commission", "fund_fees", "start_cash"]
+
+
+def batch_key(params):
+    # simulations with the same key (all the parameters but BATCHED) can run in one batch
+    return tuple(sorted((name, repr(value)) for name, value in params.items() if name not in BATCHED))
+
+
+class BatchBacktest:
+    """
+    A class to run several backtests together, in a single calendar loop.
+
+    The backtests must be of the same class and differ only in the
+    **BATCHED** parameters, so that their calendar, schedule and signals
+    are the same. The data, the support indexes (calculate_support_index,
+    which must not depend on the batched parameters) and the schedule are
+    computed once, by the first backtest, which then runs the simulation
+    routines of its class (see Backtest) over the portfolios of all the
+    backtests, so that every day, price lookup and event check is processed
+    once for all of them.
+
+    The strategies of the backtests run as usual and the orders booked by
+    their **allocate** calls are booked together. At the end, the ledgers
+    and books are split back into the backtests, which then hold the same
+    results as if they had been run one by one.
+
+
+    Attributes
+    ----------
+    backtests : list
+        backtests run together, already with their data and series
+
+    Methods
+    -------
+    run():
+        Runs the simulations
+    """
+
+    def __init__(self, backtests):
+        self.backtests = list(backtests)
+
+
+    def _setup(self):
+        # runs the setup of the first backtest and shares its results with the others
+        leader = self.backtests[0]
+        for backtest in self.backtests[1:]:
+            if type(backtest) is not type(leader) or (backtest.start, backtest.end) != (leader.start, leader.end):
+                raise ValueError("Backtests of a batch must be of the same class and calendar")
+
+        before = dict(leader.__dict__)
+        leader.set_calendar()
+        leader.load_sectors_data()
+        leader.load_mkt_portfolio()
+        leader.get_cash_fund()
+        leader._compile_schedule()
+        leader.calculate_support_index()
+        leader._align_lines()
+        shared = {name: value for name, value in leader.__dict__.items()
+                  if name not in before or before[name] is not value}
+        for backtest in self.backtests[1:]:
+            backtest.__dict__.update(shared)
+
+
+    def run(self):
+        self._setup()
+
+        leader = self.backtests[0]
+        leader._create_support_ledgers(self.backtests)
+        leader._loop_calendar()
+        leader._split()
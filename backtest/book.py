@@ -0,0 +1,359 @@
+import numpy as np
+import pandas as pd
+
+
+class Codes:
+    """
+    A class to map the labels of a column to integer codes.
+
+    Missing labels (None) are coded as -1.
+    """
+
+    def __init__(self, labels=()):
+        self.labels = list()
+        self.index = dict()
+        for label in labels:
+            self.encode(label)
+
+
+    def encode(self, label):
+        if label is None:
+            return -1
+        try:
+            return self.index[label]
+        except KeyError:
+            code = len(self.labels)
+            self.labels.append(label)
+            self.index[label] = code
+            return code
+
+
+    def decode(self, codes):
+        labels = np.array(self.labels + [None], dtype=object)
+        return labels[codes]
+
+
+
+class Book:
+    """
+    A class to represent a table of records stored as growable typed columns.
+
+    Rows are appended into preallocated numpy buffers which double in size
+    when full, so each append costs O(1). Text columns are stored as integer
+    codes and the "date" column is derived from "day". The DataFrame is built
+    once, when requested through **frame**, and cached until the book changes.
+
+
+    Attributes
+    ----------
+    calendar : pandas.DatetimeIndex
+        simulation calendar, used to fill the "date" column from "day"
+    size : int
+        number of records in the book
+
+    Methods
+    -------
+    append(**values):
+        Appends a record and returns its row number
+    extend(n, **values):
+        Appends n records from arrays and returns their row numbers
+    update(rows, **values):
+        Updates fields of existing records
+    get(row, name):
+        Returns a field of a record
+    column(name):
+        Returns the array of a column
+    take(rows, book=None):
+        Returns a new book with some of the records
+    rebase(calendar, **labels):
+        Moves the book to a longer calendar and new label codes
+    frame():
+        Builds the DataFrame of the book
+    """
+
+    # (name, kind): "int" and "float" columns, "text" columns stored as codes
+    # and the "date" column derived from "day"
+    schema = []
+
+    def __init__(self, calendar, capacity=1024, **labels):
+        self.calendar = calendar
+        self.size = 0
+        self.capacity = capacity
+
+        self.data = dict()
+        self.codes = dict()
+        for name, kind in self.schema:
+            if kind == "text":
+                self.codes[name] = Codes(labels.get(name, ()))
+            if kind != "date":
+                self.data[name] = self._empty(kind, capacity)
+
+        self._frame = None
+
+
+    @staticmethod
+    def _empty(kind, capacity):
+        if kind == "int":
+            return np.zeros(capacity, dtype=np.int64)
+        elif kind == "float":
+            return np.full(capacity, np.nan)
+        elif kind == "text":
+            return np.full(capacity, -1, dtype=np.int64)
+
+
+    def _reserve(self, n):
+        if self.size + n <= self.capacity:
+            return
+        capacity = max(2 * self.capacity, self.size + n)
+        for name, kind in self.schema:
+            if kind == "date":
+                continue
+            tmp = self._empty(kind, capacity)
+            tmp[:self.size] = self.data[name][:self.size]
+            self.data[name] = tmp
+        self.capacity = capacity
+
+
+    def _set(self, rows, values):
+        # text columns take labels, or integer arrays of codes
+        for name, value in values.items():
+            if name in self.codes:
+                if isinstance(value, str) or value is None:
+                    value = self.codes[name].encode(value)
+                elif not isinstance(value, np.ndarray) or value.dtype.kind not in "iu":
+                    value = [self.codes[name].encode(label) for label in value]
+            self.data[name][rows] = value
+        self._frame = None
+
+
+    def append(self, **values):
+        self._reserve(1)
+        row = self.size
+        self.size += 1
+        self._set(row, values)
+        return row
+
+
+    def extend(self, n, **values):
+        self._reserve(n)
+        rows = np.arange(self.size, self.size + n)
+        self.size += n
+        self._set(rows, values)
+        return rows
+
+
+    def update(self, rows, **values):
+        self._set(rows, values)
+
+
+    def code(self, name, label):
+        return self.codes[name].encode(label)
+
+
+    def get(self, row, name):
+        value = self.data[name][row]
+        if name in self.codes:
+            return self.codes[name].decode(value)
+        return value
+
+
+    def column(self, name):
+        return self.data[name][:self.size]
+
+
+    def take(self, rows, book=None):
+        # new book with the given rows, of the class of **book** (default the same), 
+        # which may have a subset of the columns, or more (left empty, e.g. zero)
+        book = book or type(self)
+        new = book(self.calendar, capacity=max(len(rows), 1))
+        for name, kind in new.schema:
+            if name not in self.data and kind != "date":
+                continue
+            if kind == "text":
+                new.codes[name] = Codes(self.codes[name].labels)
+            if kind != "date":
+                new.data[name][:len(rows)] = self.data[name][rows]
+        new.size = len(rows)
+        return new
+
+
+    def rebase(self, calendar, **labels):
+        # moves the book to a calendar starting with the current one and recodes text 
+        # columns to new labels (with all the labels used), e.g. the tickers of a new universe
+        if len(calendar) < len(self.calendar) or not calendar[:len(self.calendar)].equals(self.calendar):
+            raise ValueError("The calendar must start with the calendar of the book")
+        self.calendar = calendar
+        for name, values in labels.items():
+            codes = Codes(values)
+            missing = [label for label in self.codes[name].labels if label not in codes.index]
+            if missing:
+                raise ValueError("Labels missing from {}: {}".format(name, missing))
+            recode = np.array([codes.encode(label) for label in self.codes[name].labels] + [-1], dtype=np.int64)
+            self.data[name][:self.size] = recode[self.column(name)]
+            self.codes[name] = codes
+        self._frame = None
+
+
+    def frame(self):
+        if self._frame is None:
+            df = pd.DataFrame(index=pd.RangeIndex(self.size))
+            for name, kind in self.schema:
+                if kind == "date":
+                    df[name] = self.calendar[self.column("day")]
+                elif kind == "text":
+                    df[name] = self.codes[name].decode(self.column(name))
+                else:
+                    df[name] = self.column(name).copy()
+            self._frame = df
+        return self._frame
+
+
+
+class OrderBook(Book):
+    """
+    Order Book ledger
+
+    Registered orders are indexed by (day, auction), the auction in which they
+    will be executed, and by (day, ticker), so that pending orders are found
+    without scanning the book. The index is updated as orders are registered,
+    filled or rejected.
+    """
+
+    schema = [("day", "int"), ("date", "date"), ("order_type", "text"), ("ticker", "text"),
+              ("quantity", "float"), ("price", "float"), ("value", "float"),
+              ("commission", "float"), ("cost", "float"),
+              ("status", "text"), ("purpose", "text"), ("message", "text")]
+
+    def __init__(self, calendar, capacity=1024, **labels):
+        super().__init__(calendar, capacity, **labels)
+        self.queue = dict()     # (day, auction) -> rows
+        self.pending = dict()   # (day, ticker code) -> rows
+
+
+    def take(self, rows, book=None):
+        # registered orders are kept registered in the new book
+        new = super().take(rows, book)
+        offsets = np.full(self.size + 1, -1, dtype=np.int64)
+        offsets[rows] = np.arange(len(rows))
+        for key, queued in self.queue.items():
+            queued = offsets[queued]
+            queued = queued[queued >= 0]
+            if queued.size:
+                new.queue[key] = queued.tolist()
+        new._index()
+        return new
+
+
+    def rebase(self, calendar, **labels):
+        super().rebase(calendar, **labels)
+        self._index()
+
+
+    def _index(self):
+        # rebuilds the (day, ticker) index of the registered orders
+        self.pending = dict()
+        for queued in self.queue.values():
+            queued = np.array(queued, dtype=np.int64)
+            for row, key in zip(queued.tolist(), self._keys(queued)):
+                self.pending.setdefault(key, []).append(row)
+
+
+    def _keys(self, rows):
+        # pending index keys of the orders
+        return zip(self.data["day"][rows].tolist(), self.data["ticker"][rows].tolist())
+
+
+    def register(self, day, auction, n, **values):
+        # registers n orders to be executed in the given day and auction
+        # (no orders leave no queue, so the day is not taken for an event day by next_day)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+        rows = self.extend(n, day=day, status="registered", **values)
+        self.queue.setdefault((day, auction), []).extend(rows.tolist())
+        for row, key in zip(rows.tolist(), self._keys(rows)):
+            self.pending.setdefault(key, []).append(row)
+        return rows
+
+
+    def pending_quantity(self, day, tickers):
+        # quantity of the registered orders of each ticker (codes) in the given day
+        quantity = np.zeros(len(tickers))
+        for i, ticker in enumerate(tickers):
+            rows = self.pending.get((day, ticker))
+            if rows:
+                quantity[i] = np.nansum(self.data["quantity"][rows])
+        return quantity
+
+
+    def next_day(self, day):
+        # first day, from the given one, with orders to be executed
+        days = [key[0] for key in self.queue if key[0] >= day]
+        return min(days) if days else None
+
+
+    def pop(self, day, auction):
+        # removes and returns the orders to be executed in an auction
+        return np.array(self.queue.pop((day, auction), []), dtype=np.int64)
+
+
+    def fill(self, rows, **values):
+        self.update(rows, status="completed", **values)
+        self._unregister(rows)
+
+
+    def reject(self, rows, message):
+        self.update(rows, status="not completed", message=message)
+        self._unregister(rows)
+
+
+    def _unregister(self, rows):
+        rows = np.atleast_1d(rows)
+        for row, key in zip(rows.tolist(), self._keys(rows)):
+            pending = self.pending[key]
+            pending.remove(row)
+            if not pending:
+                del self.pending[key]
+
+
+
+class ExpenseBook(Book):
+    """Fund Expenses ledger"""
+
+    schema = [("day", "int"), ("date", "date"), ("expense_type", "text"), ("ticker", "text"),
+              ("value", "float"), ("purpose", "text")]
+
+
+
+class BatchOrderBook(OrderBook):
+    """
+    Order Book ledger of several portfolios simulated together
+
+    Orders have the offset of their portfolio and pending orders are indexed
+    by (day, portfolio, ticker).
+    """
+
+    schema = OrderBook.schema + [("portfolio", "int")]
+
+    def _keys(self, rows):
+        return zip(self.data["day"][rows].tolist(), self.data["portfolio"][rows].tolist(), 
+                   self.data["ticker"][rows].tolist())
+
+
+    def pending_quantities(self, day, portfolios, tickers):
+        # quantity of the registered orders of each portfolio and ticker (codes) in the given day
+        # only the orders pending in the day are read, and summed into (portfolios, tickers) at once
+        rows = [row for key, pending in self.pending.items() if key[0] == day for row in pending]
+        if not rows:
+            return np.zeros((len(portfolios), len(tickers)))
+        rows = np.array(rows, dtype=np.int64)
+        in_portfolio = self.data["portfolio"][rows][:, None] == np.asarray(portfolios)[None, :]
+        in_ticker = self.data["ticker"][rows][:, None] == np.asarray(tickers)[None, :]
+        quantity = np.nan_to_num(self.data["quantity"][rows])
+        return in_portfolio.T.astype(np.float64).dot(in_ticker * quantity[:, None])
+
+
+
+class BatchExpenseBook(ExpenseBook):
+    """Fund Expenses ledger of several portfolios simulated together"""
+
+    schema = ExpenseBook.schema + [("portfolio", "int")]
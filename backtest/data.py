@@ -1,13 +1,21 @@
 import os
+import io
 import re
 import json
+import pickle
+import shutil
+import hashlib
+import numpy as np
 import pandas as pd
 from importlib import import_module
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import progressbar as pb
 
 from .support import get_calendar
-from .definitions import SERIES_DATA, AMAGO_MASTER_CNPJ
+from .definitions import SERIES_DATA, INDICATORS_DATA, CACHE_DATA, AMAGO_MASTER_CNPJ
+from .indicators import IndicatorStore
+from .shared import SharedLines
 
 
 AMAGO_MASTER_CNPJ = re.sub("\D", "", AMAGO_MASTER_CNPJ)
@@ -97,62 +105,487 @@ def cash_fund_from_risk_free_rate(risk_free_rate, calendar):
     cash_fund.name = "cash_fund"
 
 
+def _read_file(path, entry=None):
+    # reads an asset file, run by the workers of CSVData.load
+    # with the manifest entry of the file (see CSVData), only the rows appended since it was
+    # read are parsed, if the file was only appended to (its last bytes read are the same, the
+    # new rows are later)
+    # returns the rows, whether they replace the ones read before, and the new entry of the file
+    with open(path, "rb") as file:
+        stat = os.fstat(file.fileno())
+        if entry is not None and stat.st_size > entry["offset"] and entry["tail"].endswith(b"\n"):
+            file.seek(entry["offset"] - len(entry["tail"]))
+            if file.read(len(entry["tail"])) == entry["tail"]:
+                data = file.read()
+                df = pd.read_csv(io.BytesIO(data), header=None, names=entry["columns"])
+                dates = pd.to_datetime(df["date"])
+                if len(df) == 0 or entry["last_date"] is None or dates.min() > entry["last_date"]:
+                    last_date = dates.max() if len(df) > 0 else entry["last_date"]
+                    return df, False, {"size": stat.st_size, "mtime": stat.st_mtime_ns,
+                                       "offset": entry["offset"] + len(data), 
+                                       "tail": (entry["tail"] + data)[-64:],
+                                       "columns": entry["columns"], "rows": entry["rows"] + len(df),
+                                       "last_date": last_date}
+            file.seek(0)
+        data = file.read()
+    df = pd.read_csv(io.BytesIO(data))
+    last_date = pd.to_datetime(df["date"]).max() if len(df) > 0 else None
+    return df, True, {"size": stat.st_size, "mtime": stat.st_mtime_ns, "offset": len(data), 
+                      "tail": data[-64:], "columns": list(df.columns), "rows": len(df), 
+                      "last_date": last_date}
+
+
+def _date_bounds(first_date, last_date):
+    # bounds of a date range selected with partial date strings (e.g. "2020-06" is the whole month)
+    first = pd.Period(first_date).start_time if first_date is not None else pd.Timestamp.min
+    last = pd.Period(last_date).end_time if last_date is not None else pd.Timestamp.max
+    return first, last
+
+
+def _select_dates(frames, first_date, last_date):
+    # dates of the rows of each file and mask of the dates in the range
+    first, last = _date_bounds(first_date, last_date)
+    dates = [pd.to_datetime(frame[1]["date"]).values for frame in frames]
+    selected = [(values >= first.to_datetime64()) & (values <= last.to_datetime64()) for values in dates]
+    return dates, selected
+
+
+def _base_dtype(dtypes):
+    # common dtype of a column of several files
+    if all(dtype.kind in "biuf" for dtype in dtypes):
+        return np.result_type(*dtypes)
+    return np.dtype(object)
+
+
+def _panel_dtype(dtype, missing):
+    # as in a pivot of the whole files, missing cells make integers float and booleans objects
+    if missing:
+        return {"i": np.dtype(np.float64), "u": np.dtype(np.float64), "b": np.dtype(object)}.get(dtype.kind, dtype)
+    return dtype
+
+
+def _empty_panel(shape, dtype):
+    if dtype.kind in "fO":
+        return np.full(shape, np.nan, dtype=dtype)
+    return np.empty(shape, dtype=dtype)
+
+
+def build_panels(frames, lines=None, first_date=None, last_date=None):
+    """Builds the line panels (date x ticker) of a set of files
+
+    Each column of each file is placed directly into a preallocated array,
+    aligned to the sorted union of the dates in the range, so values are
+    never held in a long format frame nor pivoted. Tickers are sorted.
+    Integer and boolean lines with missing values become float and object.
+
+    Parameters
+    ----------
+    frames : list
+        (ticker, DataFrame) of each file, with a "date" column
+    lines : list, default : None
+        Columns to build, default all the columns of the files
+    first_date, last_date : str, default : None
+        Date range of the panels (inclusive)
+
+    Returns
+    -------
+    dict
+        DataFrame of each line, by name
+    """
+    frames = [(ticker, df) for ticker, df in frames if len(df) > 0]
+    dates, selected = _select_dates(frames, first_date, last_date)
+    n_dates = np.unique(np.concatenate(dates)).size if dates else 0
+    index = np.unique(np.concatenate([values[mask] for values, mask in zip(dates, selected)])) if dates else []
+    index = pd.DatetimeIndex(index, name="date")
+    tickers = sorted(ticker for ticker, df in frames)
+    columns = pd.Index(tickers, name="ticker")
+    column = {ticker: j for j, ticker in enumerate(tickers)}
+
+    if lines is None:
+        lines = [name for name in dict.fromkeys(name for ticker, df in frames for name in df.columns) 
+                 if name != "date"]
+
+    panels = dict()
+    for line in lines:
+        present = [df[line].dtype for ticker, df in frames if line in df.columns]
+        if not present:
+            raise KeyError(line)
+        size = sum(len(df) for ticker, df in frames if line in df.columns)
+        dtype = _panel_dtype(_base_dtype(present), size < n_dates * len(tickers))
+
+        panel = _empty_panel((len(index), len(tickers)), dtype)
+        for (ticker, df), values, mask in zip(frames, dates, selected):
+            if line in df.columns:
+                rows = index.searchsorted(values[mask])
+                panel[rows, column[ticker]] = df[line].values[mask]
+        panels[line] = pd.DataFrame(panel, index=index, columns=columns, copy=False)
+    return panels
+
+
+def extend_panels(panels, frames, dtypes, first_date=None, last_date=None):
+    """Extends line panels with new rows of some files
+
+    The panels are copied into arrays aligned to the union of their dates
+    and the dates of the new rows in the range, and the new rows are placed
+    as in **build_panels**. Files read whole replace their cells.
+
+    Parameters
+    ----------
+    panels : dict
+        DataFrame of each line, by name, as built by **build_panels**
+    frames : list
+        (ticker, DataFrame, replace) of each file: the rows appended to the
+        file, or all its rows if **replace**
+    dtypes : dict
+        dtype of each line
+    first_date, last_date : str, default : None
+        Date range of the panels (inclusive)
+
+    Returns
+    -------
+    dict
+        Extended DataFrame of each line, by name
+    """
+    dates, selected = _select_dates(frames, first_date, last_date)
+    previous = next(iter(panels.values()))
+    index = np.unique(np.concatenate([previous.index.values] + [values[mask] for values, mask in zip(dates, selected)]))
+    index = pd.DatetimeIndex(index, name="date")
+    tickers = sorted(set(previous.columns) | {ticker for ticker, df, replace in frames if len(df) > 0})
+    columns = pd.Index(tickers, name="ticker")
+    column = {ticker: j for j, ticker in enumerate(tickers)}
+    rows = index.get_indexer(previous.index)
+
+    extended = dict()
+    for line, panel in panels.items():
+        values = _empty_panel((len(index), len(tickers)), dtypes[line])
+        values[np.ix_(rows, columns.get_indexer(panel.columns))] = panel.values
+        for (ticker, df, replace), file_dates, mask in zip(frames, dates, selected):
+            if ticker not in column:
+                continue
+            if replace and values.dtype.kind in "fO":
+                values[:, column[ticker]] = np.nan
+            if line in df.columns:
+                values[index.searchsorted(file_dates[mask]), column[ticker]] = df[line].values[mask]
+        extended[line] = pd.DataFrame(values, index=index, columns=columns, copy=False)
+    return extended
+
+
 class CSVData:
+    """
+    A class to load the asset files of a directory into lines, one DataFrame
+    (date x ticker) per column of the files.
+
+    Files are parsed by a pool of **workers** threads or processes
+    (**executor**). Parsing releases the GIL for most of its work, so threads
+    are usually enough; processes avoid the GIL entirely at the cost of
+    sending each parsed file back to the main process.
+
+    With **cache**, the lines are saved after they are loaded as binary
+    arrays (.npy) with their indexes, and later loads read them back
+    without parsing the files, as long as the files (names, sizes and
+    modification times) and the load arguments are the same. When files
+    change, only the new files and the rows appended to the changed files
+    are read, and the cached lines are extended with them (files which were
+    not only appended to are read whole, and removing files or adding
+    columns rebuilds the cache).
+
+    With **mmap**, the lines stay on disk: they are cached and each line is
+    opened as a read-only memory-mapped DataFrame on its first access. Memory
+    then tracks the lines (and pages) actually read and processes reading
+    the same lines share the OS page cache.
+
+
+    Attributes
+    ----------
+    path : str
+        directory of the asset files, one file per ticker
+    first_date, last_date : str
+        date range of the lines
+    lines : list
+        columns loaded (default all)
+    workers : int
+        number of files parsed in parallel
+    executor : str
+        "thread" or "process"
+    cache : boolean
+        whether the lines are loaded from and saved to the cache
+    mmap : boolean
+        whether the lines are memory-mapped from the cache, opened lazily
+
+    Methods
+    -------
+    load():
+        Loads the lines
+    get_line(name):
+        Returns a line, opened on its first access
+    get_lines():
+        Returns the lines, by name (opens them all)
+    """
 
     widgets_load = ['Loading securities info: ', pb.Percentage(), ' ', pb.Bar(marker=pb.RotatingMarker()), ' ', pb.ETA()]
     
-    def __init__(self, path, first_date, last_date, lines=None):
+    def __init__(self, path, first_date, last_date, lines=None, 
+                 indicators_size=32, persist_indicators=False,
+                 workers=1, executor="thread", cache=False, mmap=False):
         self.__lines = dict()
+        self.__files = None    # cached lines not opened yet (mmap)
 
         self.path = path
         self.lines = lines
         self.first_date = first_date
         self.last_date = last_date
 
+        if executor not in ("thread", "process"):
+            raise ValueError("executor must be 'thread' or 'process'")
+        self.workers = workers
+        self.executor = executor
+        self.cache = cache or mmap
+        self.mmap = mmap
+
         self.tickers = list()
+        self.fingerprint = None
+
+        # indicators computed over the lines, shared by the simulations using this data
+        self.indicators = IndicatorStore(indicators_size, 
+                                         INDICATORS_DATA if persist_indicators else None)
     
 
     def __getattr__(self, name):
+        # private names are never lines; looking them up here would recurse 
+        # while an unpickled instance has no state yet
         try:
-            return self.__lines[name]
+            if name.startswith("_"):
+                raise KeyError(name)
+            return self.get_line(name)
         except KeyError:
             msg = "'{0}' object has no attribute '{1}'"
             raise AttributeError(msg.format(type(self).__name__, name))
 
 
+    def _open(self, name):
+        # memory-maps a cached line on its first access
+        entry = self.__files["lines"][name]
+        line = SharedLines.attach({"lines": {name: entry}})[name]
+        self.__lines[name] = line
+        return line
+
+
     def load(self):
 
         self.files = [file for file in os.listdir(self.path) \
                         if file.split(".")[1]=="csv"]
+        self.tickers = [file.split(".")[0] for file in self.files]
+        fingerprint = self._fingerprint()
+
+        if self.cache and (self._load_cache(fingerprint) or self._update_cache(fingerprint)):
+            return
         
-        #temporary list to hold data frame for each ticker which will then be concatenated in single dataframe
-        df_list = list() 
-        
+        # parsed file of each ticker, placed into the panels of the lines
+        parsed = self._read(self.files)
+        df_list = [(file.split(".")[0], df) for file, df, replace, entry in parsed]
+        self.__lines.update(build_panels(df_list, self.lines or None, self.first_date, self.last_date))
+        manifest = self._manifest(dict(), parsed) if self.cache else None
+        del df_list, parsed
+
+        self._loaded(fingerprint, manifest)
+
+
+    def _read(self, files, entries=None):
+        # parses the files (from their manifest entries, if given) in parallel, in order
+        # returns (file, rows, replace, entry) of each file, see _read_file
         timer_load = pb.ProgressBar(widgets=self.widgets_load, 
-                                    maxval=len(self.files)).start()
-        
-        for i, file in enumerate(self.files):
-            path = os.path.join(self.path, file)
-            df = pd.read_csv(path)
-            ticker = file.split(".")[0]
-            df["ticker"] = ticker
-            df_list.append(df)
-            self.tickers.append(ticker)
-
-            timer_load.update(i)
+                                    maxval=max(len(files), 1)).start()
+
+        paths = [os.path.join(self.path, file) for file in files]
+        entries = [(entries or dict()).get(file) for file in files]
+        if self.workers > 1:
+            pool = (ThreadPoolExecutor if self.executor == "thread" else ProcessPoolExecutor)(self.workers)
+            results = pool.map(_read_file, paths, entries)
+        else:
+            pool = None
+            results = map(_read_file, paths, entries)
+
+        parsed = list()
+        try:
+            for i, (file, result) in enumerate(zip(files, results)):
+                parsed.append((file,) + result)
+                timer_load.update(i)
+        finally:
+            if pool is not None:
+                pool.shutdown()
             
         timer_load.finish()
-            
-        dfs = pd.concat(df_list).set_index(["date", "ticker"]) # concatenate list of dfs and set index
-        
-        lines = self.lines or dfs.columns
+        return parsed
+
+
+    def _loaded(self, fingerprint, manifest):
+        self.fingerprint = fingerprint
+        if self.cache:
+            self._save_cache(manifest)
+            if self.mmap:
+                # the parsed lines are dropped, to be mapped from the cache
+                self.__lines.clear()
+                self._load_cache(fingerprint)
+
+
+    def _fingerprint(self):
+        # identifies the data loaded: source files (names, sizes, mtimes) and load arguments
+        files = list()
+        for file in sorted(self.files):
+            stat = os.stat(os.path.join(self.path, file))
+            files.append((file, stat.st_size, stat.st_mtime_ns))
+        key = (os.path.abspath(self.path), self.first_date, self.last_date, self.lines, files)
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+    def _cache_path(self):
+        # descriptor of the cached lines of the same files and load arguments
+        key = (os.path.abspath(self.path), self.first_date, self.last_date, self.lines)
+        return os.path.join(CACHE_DATA, hashlib.sha1(repr(key).encode()).hexdigest() + ".pkl")
+
+
+    def _load_cache(self, fingerprint):
+        # loads the lines from the cache, if it is up to date
+        path = self._cache_path()
+        if not os.path.isfile(path):
+            return False
+        with open(path, "rb") as file:
+            descriptor = pickle.load(file)
+        if descriptor["data"]["fingerprint"] != fingerprint:
+            return False
+        if not all(os.path.isfile(entry["file"]) for entry in descriptor["lines"].values() if "file" in entry):
+            return False
+
+        print("Securities: loading from cache:", self.path)
+        self.tickers = list(descriptor["data"]["tickers"])
+        if self.mmap:
+            self.__files = descriptor
+        else:
+            self.__lines.update(SharedLines.attach(descriptor, mmap_mode=None))
+        self.fingerprint = fingerprint
+        return True
+
+
+    def _manifest(self, manifest, parsed):
+        # manifest of the files cached, updated with the files parsed: the entry of each file
+        # (size, modification time, bytes read and the last of them, columns, rows and last date),
+        # the union of the dates of all the files and the common dtype of each column
+        files = dict(manifest.get("files", dict()))
+        dates = [manifest.get("dates", np.array([], dtype="datetime64[ns]"))]
+        dtypes = dict(manifest.get("dtypes", dict()))
+        for file, df, replace, entry in parsed:
+            files[file] = entry
+            dates.append(pd.to_datetime(df["date"]).values)
+            for name in df.columns:
+                if name != "date":
+                    dtypes[name] = _base_dtype([df[name].dtype] + ([dtypes[name]] if name in dtypes else []))
+        return {"files": files, "dates": np.unique(np.concatenate(dates)), "dtypes": dtypes}
+
+
+    def _update_cache(self, fingerprint):
+        # extends the cached lines with the files changed since they were cached (new files and 
+        # the rows appended to the files, see _read_file) 
+        # files removed or new columns rebuild the cache
+        path = self._cache_path()
+        if not os.path.isfile(path):
+            return False
+        with open(path, "rb") as file:
+            descriptor = pickle.load(file)
+        manifest = descriptor["data"].get("manifest")
+        if manifest is None or set(manifest["files"]) - set(self.files):
+            return False
+
+        changed = list()
+        for file in self.files:
+            entry = manifest["files"].get(file)
+            stat = os.stat(os.path.join(self.path, file))
+            if entry is None or (stat.st_size, stat.st_mtime_ns) != (entry["size"], entry["mtime"]):
+                changed.append(file)
+        print("Securities: updating cache:", self.path, "({} files changed)".format(len(changed)))
+        parsed = self._read(changed, manifest["files"])
+
+        lines = list(descriptor["lines"])
+        if not self.lines and any(name not in lines and name != "date" 
+                                  for file, df, replace, entry in parsed for name in df.columns):
+            return False
+        manifest = self._manifest(manifest, parsed)
+
+        # dtypes of the lines, as if they were built from the whole files
+        files = manifest["files"].values()
+        n_cells = manifest["dates"].size * sum(entry["rows"] > 0 for entry in files)
+        dtypes = dict()
         for line in lines:
-            tmp = dfs[line].unstack("ticker")
-            tmp.index = pd.to_datetime(tmp.index)
-            tmp = tmp.loc[self.first_date:self.last_date]
-            self.__lines[line] = tmp
+            size = sum(entry["rows"] for entry in files if line in entry["columns"])
+            dtypes[line] = _panel_dtype(manifest["dtypes"][line], size < n_cells)
+
+        frames = [(file.split(".")[0], df, replace) for file, df, replace, entry in parsed]
+        self.__lines.update(extend_panels(SharedLines.attach(descriptor), frames, dtypes, 
+                                          self.first_date, self.last_date))
+        self._loaded(fingerprint, manifest)
+        return True
+
+
+    def _save_cache(self, manifest):
+        # saves the lines to the cache, replacing the outdated ones
+        path = self._cache_path()
+        if os.path.isfile(path):
+            with open(path, "rb") as file:
+                shutil.rmtree(pickle.load(file)["data"]["directory"], ignore_errors=True)
+
+        shared = SharedLines(self.__lines, CACHE_DATA)
+        shared.descriptor["data"] = {"tickers": self.tickers, "fingerprint": self.fingerprint,
+                                     "directory": shared.path, "manifest": manifest}
+        with open(path + ".tmp", "wb") as file:
+            pickle.dump(shared.descriptor, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+
+    def indicator(self, line, transform, window=None, **params):
+        # memoized indicator of a line (e.g. indicator("volume", "mean", 63))
+        return self.indicators.get(self, line, transform, window, **params)
+
+
+    def share(self, path=None):
+        # publishes the lines into memory-mapped files, other processes rebuild 
+        # the data without copies with attach(shared.descriptor)
+        # (memory-mapped lines are published as their cache files)
+        if self.__files is not None:
+            shared = SharedLines(dict(), path)
+            shared.descriptor["lines"].update(self.__files["lines"])
+        else:
+            shared = SharedLines(self.__lines, path)
+        shared.descriptor["data"] = {"path": self.path, "first_date": self.first_date, 
+                                     "last_date": self.last_date, "lines": self.lines,
+                                     "tickers": self.tickers, "fingerprint": self.fingerprint}
+        return shared
+
+
+    @classmethod
+    def attach(cls, descriptor):
+        # data object over the lines published by share, read-only
+        info = descriptor["data"]
+        obj = cls(info["path"], info["first_date"], info["last_date"], info["lines"])
+        obj.tickers = list(info["tickers"])
+        obj.fingerprint = info["fingerprint"]
+        # the lines are mapped on their first access, as with mmap
+        obj.__files = {"lines": descriptor["lines"]}
+        return obj
+
+
+    def get_line(self, name):
+        # returns a line, memory-mapped on its first access (KeyError if there is no such line)
+        if name not in self.__lines and self.__files is not None and name in self.__files["lines"]:
+            return self._open(name)
+        return self.__lines[name]
+
 
     def get_lines(self):
+        # opens the memory-mapped lines not accessed yet (in the order they were loaded)
+        if self.__files is not None:
+            for name in self.__files["lines"]:
+                if name not in self.__lines:
+                    self._open(name)
+            self.__lines = {name: self.__lines[name] for name in self.__files["lines"]}
         return self.__lines
 
 
@@ -10,6 +10,8 @@ SERIES_DATA = check_dir(os.path.join("data","series"))
 RESULTS_DATA = check_dir(os.path.join("data","results"))
 SECTORS_DATA = check_dir(os.path.join("data","sectors"))
 MKT_PORTFOLIO_DATA = check_dir(os.path.join("data","mkt_portfolio"))
+INDICATORS_DATA = check_dir(os.path.join("data","indicators"))
+CACHE_DATA = check_dir(os.path.join("data","cache"))
 
 # ANALYSIS
 EXPORTED_DATA = check_dir(os.path.join(RESULTS_DATA,"exported"))
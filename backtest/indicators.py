@@ -0,0 +1,107 @@
+import os
+import hashlib
+from collections import OrderedDict
+
+import pandas as pd
+
+
+# transforms computed over a rolling window
+ROLLING = ["mean", "std", "var", "sum", "min", "max", "median", "count"]
+
+# keywords of the rolling window, the other params go to the transform
+ROLLING_PARAMS = ["min_periods", "center"]
+
+
+def compute(frame, transform, window=None, **params):
+    """Computes an indicator over a line
+
+    Parameters
+    ----------
+    frame : pandas.DataFrame
+        Line with "date" as index and tickers as columns
+    transform : str
+        A rolling transform (**ROLLING**) over **window** days, "ewm" (mean
+        with span **window**), "pct_change" (over **window** days) or "rank"
+        (across tickers, on each date)
+    window : int, default : None
+        Window of the transform
+    params :
+        Extra arguments of the transform
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indicator with the same index and columns of **frame**
+    """
+    if transform in ROLLING:
+        rolling = {key: params.pop(key) for key in ROLLING_PARAMS if key in params}
+        return getattr(frame.rolling(window, **rolling), transform)(**params)
+    elif transform == "ewm":
+        return frame.ewm(span=window, **params).mean()
+    elif transform == "pct_change":
+        return frame.pct_change(window or 1, **params)
+    elif transform == "rank":
+        return frame.rank(axis=1, **params)
+    raise ValueError("Unknown transform: {}".format(transform))
+
+
+
+class IndicatorStore:
+    """
+    A class to memoize indicators computed over the lines of a data object.
+
+    Indicators are keyed by (fingerprint, line, transform, window, params),
+    where the fingerprint identifies the data, so each indicator is computed
+    once and shared by every simulation using the same data. The most
+    recently used indicators are kept in memory and, if **path** is given,
+    persisted to disk. Stored indicators must not be modified in place.
+
+
+    Attributes
+    ----------
+    maxsize : int
+        maximum number of indicators kept in memory
+    path : str
+        directory to persist the indicators (None keeps them only in memory)
+
+    Methods
+    -------
+    get(data, line, transform, window=None, **params):
+        Returns an indicator, computing it only if not stored
+    clear():
+        Removes the indicators from memory
+    """
+
+    def __init__(self, maxsize=32, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.__cache = OrderedDict()
+
+
+    def _file(self, key):
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.path, name + ".pkl")
+
+
+    def get(self, data, line, transform, window=None, **params):
+        key = (data.fingerprint, line, transform, window, tuple(sorted(params.items())))
+        if key in self.__cache:
+            self.__cache.move_to_end(key)
+            return self.__cache[key]
+
+        file = self._file(key) if self.path else None
+        if file and os.path.isfile(file):
+            indicator = pd.read_pickle(file)
+        else:
+            indicator = compute(getattr(data, line), transform, window, **params)
+            if file:
+                indicator.to_pickle(file)
+
+        self.__cache[key] = indicator
+        if len(self.__cache) > self.maxsize:
+            self.__cache.popitem(last=False)
+        return indicator
+
+
+    def clear(self):
+        self.__cache.clear()
@@ -0,0 +1,443 @@
+import numpy as np
+import pandas as pd
+
+from .definitions import INSTANTS
+
+
+class Holdings:
+    """
+    A class to record positions sparsely.
+
+    Each row (a day and instant of the ledger) stores only the offsets and
+    quantities of the tickers held, in compressed sparse row layout. Rows
+    are written in increasing order and the buffers grow as needed, so memory
+    scales with the number of names held and not with the universe.
+
+
+    Attributes
+    ----------
+    n_tickers : int
+        number of tickers of the universe
+    indptr : numpy.ndarray
+        start of each row in **indices** and **data**
+    indices : numpy.ndarray
+        ticker offsets held
+    data : numpy.ndarray
+        quantities held
+
+    Methods
+    -------
+    record(row, tickers, quantity):
+        Records the holdings of a row
+    record_many(rows, tickers, quantity):
+        Records the same holdings in several rows
+    extend(rows, counts, tickers, quantity):
+        Records several rows at once
+    select(rows):
+        Returns the holdings of a set of rows as flat arrays
+    dense(rows):
+        Returns the holdings of a set of rows as a dense array
+    """
+
+    def __init__(self, n_rows, n_tickers, capacity=1024):
+        self.n_tickers = n_tickers
+        self.rows = 0
+        self.size = 0
+        self.indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        self.indices = np.zeros(capacity, dtype=np.int64)
+        self.data = np.zeros(capacity)
+
+
+    def _reserve(self, n):
+        if self.size + n > self.indices.size:
+            capacity = max(2 * self.indices.size, self.size + n)
+            self.indices = np.resize(self.indices, capacity)
+            self.data = np.resize(self.data, capacity)
+
+
+    def record(self, row, tickers, quantity):
+        # rows not recorded since the last one are left empty
+        if row < self.rows:
+            raise ValueError("Holdings must be recorded in increasing row order")
+        n = len(tickers)
+        self._reserve(n)
+        self.indptr[self.rows:row + 1] = self.size
+        self.indices[self.size:self.size + n] = tickers
+        self.data[self.size:self.size + n] = quantity
+        self.size += n
+        self.rows = row + 1
+        self.indptr[self.rows] = self.size
+
+
+    def record_many(self, rows, tickers, quantity):
+        # rows in increasing order, rows in between are left empty
+        rows = np.asarray(rows)
+        self.extend(rows, np.full(rows.size, len(tickers)), 
+                    np.tile(tickers, rows.size), np.tile(quantity, rows.size))
+
+
+    def extend(self, rows, counts, tickers, quantity):
+        # records several rows, in increasing order, with counts[i] holdings each
+        # (tickers and quantity of all rows concatenated), rows in between are left empty
+        rows = np.asarray(rows)
+        if rows.size == 0:
+            return
+        if rows[0] < self.rows:
+            raise ValueError("Holdings must be recorded in increasing row order")
+        n = len(tickers)
+        self._reserve(n)
+        sizes = np.zeros(rows[-1] + 1 - self.rows, dtype=np.int64)
+        sizes[rows - self.rows] = counts
+        self.indptr[self.rows + 1:rows[-1] + 2] = self.size + np.cumsum(sizes)
+        self.indices[self.size:self.size + n] = tickers
+        self.data[self.size:self.size + n] = quantity
+        self.size += n
+        self.rows = rows[-1] + 1
+
+
+    def select(self, rows):
+        # returns, for every holding in the rows, its position in rows, ticker offset and quantity
+        # (rows not recorded yet are empty)
+        rows = np.asarray(rows)
+        start = self.indptr[np.minimum(rows, self.rows)]
+        counts = self.indptr[np.minimum(rows + 1, self.rows)] - start
+        which = np.repeat(np.arange(len(start)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(start, counts)
+        return which, self.indices[offsets], self.data[offsets]
+
+
+    def dense(self, rows):
+        which, tickers, quantity = self.select(rows)
+        dense = np.zeros((len(rows), self.n_tickers))
+        dense[which, tickers] = quantity
+        return dense
+
+
+
+class Ledger:
+    """
+    A class to hold the portfolio ledgers of a backtest as numpy arrays.
+
+    The working state of the portfolio is kept in plain attributes and is
+    recorded at the end of every day, or at a chosen subset of the instants, 
+    into preallocated arrays addressed by integer offsets (day, instant). 
+    Positions are recorded sparsely, only for the tickers held. The pandas 
+    DataFrames are only built when requested through **frame**, and cached
+    until the ledger records again.
+
+
+    Attributes
+    ----------
+    calendar : pandas.DatetimeIndex
+        simulation calendar
+    tickers : list
+        tickers of the universe, in the order of the position arrays
+    instants : list
+        instants recorded, "eod" is always recorded
+    position : numpy.ndarray
+        current quantity held of each ticker
+    held : numpy.ndarray
+        offsets of the tickers currently held, in ascending order
+    cash : float
+        current cash amount
+    cash_fund_position : float
+        current number of cash fund shares
+    fund_fees_provision : float
+        current fund fees provision
+    value : float
+        current portfolio value
+
+    Methods
+    -------
+    trade(tickers, quantity):
+        Adds quantities to the positions
+    record(day, instant):
+        Records the working state at the given day and instant, if recorded
+    record_span(days, state):
+        Records consecutive days in which the positions did not change
+    rows(instant):
+        Returns the holdings rows of an instant
+    positions(instant):
+        Returns the (day, ticker) array of positions at an instant
+    frame(name):
+        Builds the DataFrame of a ledger
+    rebase(calendar, tickers):
+        Returns the ledger over a longer calendar and another universe
+    """
+
+    scalars = ["cash", "cash_fund_position", "fund_fees_provision", "value"]
+
+    def __init__(self, calendar, tickers, instants=("eod",)):
+        self.calendar = calendar
+        self.tickers = list(tickers)
+        self.instants = [instant for instant in INSTANTS if instant in instants or instant == "eod"]
+
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.instant_index = {instant: i for i, instant in enumerate(self.instants)}
+
+        shape = (len(self.calendar), len(self.instants))
+
+        # Ledgers - All day
+        self.history = {name: np.zeros(shape) for name in self.scalars}
+        self.holdings = Holdings(shape[0] * shape[1], len(self.tickers))
+
+        # Cash flow support ledgers
+        self.injection = np.zeros(len(self.calendar))
+        self.withdrawal = np.zeros(len(self.calendar))
+
+        self._frames = dict()
+        self.reset()
+
+
+    def reset(self):
+        # zeroes the working state
+        self.position = np.zeros(len(self.tickers))
+        self.held = np.zeros(0, dtype=np.int64)
+        self.cash = 0.0
+        self.cash_fund_position = 0.0
+        self.fund_fees_provision = 0.0
+        self.value = 0.0
+
+
+    def trade(self, tickers, quantity):
+        np.add.at(self.position, tickers, quantity)
+        held = np.union1d(self.held, tickers)
+        self.held = held[self.position[held] != 0]
+
+
+    def record(self, day, instant):
+        i = self.instant_index.get(instant)
+        if i is None:
+            return
+        self.holdings.record(day * len(self.instants) + i, self.held, self.position[self.held])
+        for name in self.scalars:
+            self.history[name][day, i] = getattr(self, name)
+        self._frames.clear()
+
+
+    def record_span(self, days, state):
+        # state: {instant: {scalar ledger: array over days}}, positions are the current ones
+        if len(days) == 0:
+            return
+        rows = np.asarray(days)[:, None] * len(self.instants) + np.arange(len(self.instants))
+        self.holdings.record_many(rows.ravel(), self.held, self.position[self.held])
+        for instant, i in self.instant_index.items():
+            for name in self.scalars:
+                self.history[name][days, i] = state[instant][name]
+        self._frames.clear()
+
+
+    def rows(self, instant):
+        # rows of the holdings of an instant, one per day
+        return np.arange(len(self.calendar)) * len(self.instants) + self.instant_index[instant]
+
+
+    def positions(self, instant):
+        return self.holdings.dense(self.rows(instant))
+
+
+    def frame(self, name):
+        if name not in self._frames:
+            self._frames[name] = self._frame(name)
+        return self._frames[name]
+
+
+    def _frame(self, name):
+        if name == "position":
+            data = self.holdings.dense(np.arange(len(self.calendar) * len(self.instants)))
+            data = data.reshape(len(self.calendar), -1)
+            columns = pd.MultiIndex.from_product([self.instants, self.tickers],
+                                                 names=['intstants', 'ticker'])
+            return pd.DataFrame(index=self.calendar, columns=columns, data=data)
+        elif name in self.scalars:
+            return pd.DataFrame(index=self.calendar, columns=self.instants, data=self.history[name].copy())
+        elif name in ("injection", "withdrawal"):
+            return pd.Series(index=self.calendar, data=getattr(self, name).copy())
+        raise KeyError(name)
+
+
+    def __getstate__(self):
+        # the cached frames are not pickled (e.g. in checkpoints)
+        state = self.__dict__.copy()
+        state["_frames"] = dict()
+        return state
+
+
+    def rebase(self, calendar, tickers):
+        # copy of the ledger over a calendar starting with the current one and a universe
+        # with all the current tickers (in any order), to continue the simulation
+        # (the new ledger builds its frames again)
+        if len(calendar) < len(self.calendar) or not calendar[:len(self.calendar)].equals(self.calendar):
+            raise ValueError("The calendar must start with the calendar of the ledger")
+        ledger = Ledger(calendar, tickers, self.instants)
+        missing = [ticker for ticker in self.tickers if ticker not in ledger.ticker_index]
+        if missing:
+            raise ValueError("Tickers missing from the universe: {}".format(missing))
+        index = np.array([ledger.ticker_index[ticker] for ticker in self.tickers], dtype=np.int64)
+
+        days = len(self.calendar)
+        for name in self.scalars:
+            ledger.history[name][:days] = self.history[name]
+            setattr(ledger, name, getattr(self, name))
+
+        rows = np.arange(days * len(self.instants))
+        which, tickers, quantity = self.holdings.select(rows)
+        ledger.holdings.extend(rows, np.bincount(which, minlength=rows.size), index[tickers], quantity)
+
+        ledger.injection[:days] = self.injection
+        ledger.withdrawal[:days] = self.withdrawal
+        ledger.position[index] = self.position
+        ledger.held = np.flatnonzero(ledger.position).astype(np.int64)
+        return ledger
+
+
+
+class BatchLedger:
+    """
+    A class to hold the ledgers of several portfolios simulated together.
+
+    Same as Ledger with a leading portfolio axis: the working positions are
+    a dense (portfolios, tickers) array and cash and the other scalars are
+    (portfolios,) arrays, so every portfolio is updated at once. Positions
+    are recorded sparsely, one holdings row per (day, instant, portfolio).
+    **split** returns the Ledger of a single portfolio.
+
+
+    Attributes
+    ----------
+    calendar : pandas.DatetimeIndex
+        simulation calendar
+    tickers : list
+        tickers of the universe, in the order of the position arrays
+    n_portfolios : int
+        number of portfolios
+    instants : list
+        instants recorded, "eod" is always recorded
+    position : numpy.ndarray
+        current quantity held of each ticker, (portfolios, tickers)
+    cash, cash_fund_position, fund_fees_provision, value : numpy.ndarray
+        current scalars of each portfolio, (portfolios,)
+
+    Methods
+    -------
+    trade(portfolios, tickers, quantity):
+        Adds quantities to the positions
+    record(day, instant):
+        Records the working state at the given day and instant, if recorded
+    record_span(days, state):
+        Records consecutive days in which the positions did not change
+    split(portfolio):
+        Returns the Ledger of a portfolio
+    join(ledgers):
+        Returns the BatchLedger of the Ledgers of several portfolios
+    """
+
+    scalars = Ledger.scalars
+
+    def __init__(self, calendar, tickers, n_portfolios, instants=("eod",)):
+        self.calendar = calendar
+        self.tickers = list(tickers)
+        self.n_portfolios = n_portfolios
+        self.instants = [instant for instant in INSTANTS if instant in instants or instant == "eod"]
+
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.instant_index = {instant: i for i, instant in enumerate(self.instants)}
+
+        shape = (n_portfolios, len(self.calendar), len(self.instants))
+
+        # Ledgers - All day
+        self.history = {name: np.zeros(shape) for name in self.scalars}
+        self.holdings = Holdings(shape[0] * shape[1] * shape[2], len(self.tickers))
+
+        # Cash flow support ledgers
+        self.injection = np.zeros(shape[:2])
+        self.withdrawal = np.zeros(shape[:2])
+
+        self.reset()
+
+
+    def reset(self):
+        # zeroes the working state
+        self.position = np.zeros((self.n_portfolios, len(self.tickers)))
+        for name in self.scalars:
+            setattr(self, name, np.zeros(self.n_portfolios))
+
+
+    def trade(self, portfolios, tickers, quantity):
+        np.add.at(self.position, (portfolios, tickers), quantity)
+
+
+    def _held(self):
+        # holdings of every portfolio, in portfolio and ticker order
+        portfolios, tickers = np.nonzero(self.position)
+        counts = np.bincount(portfolios, minlength=self.n_portfolios)
+        return counts, tickers, self.position[portfolios, tickers]
+
+
+    def record(self, day, instant):
+        i = self.instant_index.get(instant)
+        if i is None:
+            return
+        first = (day * len(self.instants) + i) * self.n_portfolios
+        self.holdings.extend(first + np.arange(self.n_portfolios), *self._held())
+        for name in self.scalars:
+            self.history[name][:, day, i] = getattr(self, name)
+
+
+    def record_span(self, days, state):
+        # state: {instant: {scalar ledger: (portfolios, days) array}}, positions are the current ones
+        days = np.asarray(days)
+        if days.size == 0:
+            return
+        rows = (days[:, None] * len(self.instants) + np.arange(len(self.instants))) * self.n_portfolios
+        rows = (rows[:, :, None] + np.arange(self.n_portfolios)).ravel()
+        counts, tickers, quantity = self._held()
+        repeats = days.size * len(self.instants)
+        self.holdings.extend(rows, np.tile(counts, repeats), 
+                             np.tile(tickers, repeats), np.tile(quantity, repeats))
+        for instant, i in self.instant_index.items():
+            for name in self.scalars:
+                self.history[name][:, days, i] = state[instant][name]
+
+
+    def split(self, portfolio):
+        ledger = Ledger(self.calendar, self.tickers, self.instants)
+        for name in self.scalars:
+            ledger.history[name] = self.history[name][portfolio].copy()
+            setattr(ledger, name, float(getattr(self, name)[portfolio]))
+
+        rows = np.arange(len(self.calendar) * len(self.instants))
+        which, tickers, quantity = self.holdings.select(rows * self.n_portfolios + portfolio)
+        ledger.holdings.extend(rows, np.bincount(which, minlength=rows.size), tickers, quantity)
+
+        ledger.injection = self.injection[portfolio].copy()
+        ledger.withdrawal = self.withdrawal[portfolio].copy()
+        ledger.position = self.position[portfolio].copy()
+        ledger.held = np.flatnonzero(ledger.position).astype(np.int64)
+        return ledger
+
+
+    @classmethod
+    def join(cls, ledgers):
+        # ledgers over the same calendar, tickers and instants, e.g. to continue their simulation
+        first = ledgers[0]
+        n = len(ledgers)
+        batch = cls(first.calendar, first.tickers, n, first.instants)
+        for name in cls.scalars:
+            batch.history[name] = np.stack([ledger.history[name] for ledger in ledgers])
+            setattr(batch, name, np.array([getattr(ledger, name) for ledger in ledgers], dtype=np.float64))
+
+        # holdings rows recorded by each ledger interleaved into one row per (day, instant, portfolio)
+        rows = np.arange(max(ledger.holdings.rows for ledger in ledgers))
+        selected = [ledger.holdings.select(rows) for ledger in ledgers]
+        which = np.concatenate([which * n + k for k, (which, tickers, quantity) in enumerate(selected)])
+        order = np.argsort(which, kind="stable")
+        tickers = np.concatenate([tickers for which, tickers, quantity in selected])[order]
+        quantity = np.concatenate([quantity for which, tickers, quantity in selected])[order]
+        batch.holdings.extend(np.arange(rows.size * n), np.bincount(which, minlength=rows.size * n), 
+                              tickers, quantity)
+
+        batch.injection = np.stack([ledger.injection for ledger in ledgers])
+        batch.withdrawal = np.stack([ledger.withdrawal for ledger in ledgers])
+        batch.position = np.stack([ledger.position for ledger in ledgers])
+        return batch
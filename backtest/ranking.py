@@ -0,0 +1,89 @@
+import numpy as np
+
+
+def _descending(values):
+    # sort key of a descending column, missing values last
+    return np.where(np.isnan(values), np.inf, -values)
+
+
+def _ascending(values):
+    # sort key of an ascending column, missing values last
+    return np.where(np.isnan(values), np.inf, values)
+
+
+def _take(order, selected, k):
+    # first k selected columns of each row in the given order, padded with -1
+    rows = np.arange(order.shape[0])[:, None]
+    ranked = np.where(selected[rows, order], order, -1)
+    # moves the selected columns to the front, keeping their order
+    front = np.argsort(ranked < 0, axis=1, kind="stable")
+    return np.take_along_axis(ranked, front, axis=1)[:, :k]
+
+
+def leaders(volume, selected, number):
+    """Ranks the selected tickers of several dates by volume
+
+    Parameters
+    ----------
+    volume : numpy.ndarray
+        Volumes, (dates, tickers), missing values sort last
+    selected : numpy.ndarray
+        Boolean mask of the tickers to rank, (dates, tickers)
+    number : int
+        Number of tickers
+
+    Returns
+    -------
+    numpy.ndarray
+        Column offsets of the most liquid selected tickers (dates, number),
+        highest volume first and padded with -1
+    """
+    volume = np.asarray(volume, dtype=np.float64)
+    order = np.argsort(_descending(volume), axis=-1, kind="stable")
+    return _take(order, np.asarray(selected, dtype=bool), number)
+
+
+def rank(recommendation, score, volume, eligible, number_long, number_short):
+    """Ranks the long and short candidates of several dates at once
+
+    Longs are the eligible tickers with the highest recommendation, then
+    score, then volume. Shorts are the eligible tickers recommended -1 and
+    not in the longs, with the lowest recommendation, then score, and the
+    highest volume. Missing values sort last, as in pandas.
+
+    Parameters
+    ----------
+    recommendation : numpy.ndarray
+        Recommendations, (dates, tickers)
+    score : numpy.ndarray
+        Scores, (dates, tickers)
+    volume : numpy.ndarray
+        Volumes used as the last sort key, (dates, tickers)
+    eligible : numpy.ndarray
+        Boolean eligibility mask, (dates, tickers)
+    number_long : int
+        Number of long tickers
+    number_short : int
+        Number of short tickers
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        Column offsets of the long (dates, number_long) and short
+        (dates, number_short) tickers, in rank order and padded with -1
+    """
+    recommendation = np.asarray(recommendation, dtype=np.float64)
+    score = np.asarray(score, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    eligible = np.asarray(eligible, dtype=bool)
+
+    order = np.lexsort((_descending(volume), _descending(score), _descending(recommendation)), axis=-1)
+    long = _take(order, eligible, number_long)
+
+    selected = eligible & (recommendation == -1)
+    rows, columns = np.nonzero(long >= 0)
+    selected[rows, long[rows, columns]] = False
+
+    order = np.lexsort((_descending(volume), _ascending(score), _ascending(recommendation)), axis=-1)
+    short = _take(order, selected, number_short)
+    return long, short
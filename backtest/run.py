@@ -1,33 +1,197 @@
+import os
 import json
+import traceback
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-def run_simulation(backtest):
+from .analysis import summary
+from .definitions import RESULTS_DATA
+from .batch import BatchBacktest, batch_key
+
+# simulations to run, shared with the worker processes by the pool initializer
+_shared = None
+
+
+def run_simulation(backtest, save=True, resume=False):
+    # resume: continues the simulation from its checkpoint, if there is one
     backtest.set_calendar()
     backtest.load_sectors_data()
     backtest.load_mkt_portfolio()
-    backtest.run()
-    backtest.save_results()
-    
-    
-def run(amago, data_obj, series, config="config.json", test=False):
+    if resume and os.path.exists(os.path.join(RESULTS_DATA, backtest.name + ".ckpt")):
+        backtest.resume()
+    else:
+        backtest.run()
+    if save:
+        backtest.save_results()
+
+
+def _init_worker(shared):
+    global _shared
+    if shared is not None and isinstance(shared[1], tuple):
+        # data published by share: attaches to the memory-mapped lines
+        data_class, descriptor = shared[1]
+        shared = (shared[0], data_class.attach(descriptor)) + shared[2:]
+    _shared = shared
+
+
+def _create(params):
+    amago, data_obj, series, schedule = _shared[:4]
+    print("Starting simulation:", params["name"])
+    obj = amago(**params)
+    if schedule is not None:
+        obj.schedule = schedule
+    obj.add_data(data_obj)
+    obj.add_series(series)
+    return obj
+
+
+def _run_task(group):
+    # runs a group of simulations (indexes), returns for each one the backtest (if kept), 
+    # its summary statistics (if requested) or the error traceback
+    # groups of several simulations run together in a BatchBacktest
+    simulations, keep, summarize, resume = _shared[4:]
+    try:
+        objs = [_create(simulations[i]) for i in group]
+        if len(objs) > 1:
+            BatchBacktest(objs).run()
+        for i, obj in zip(group, objs):
+            kept = keep is None or i in keep
+            if len(objs) > 1:
+                if kept:
+                    obj.save_results()
+            else:
+                run_simulation(obj, save=kept, resume=resume)
+        stats = [summary(obj) if summarize else None for obj in objs]
+        return [((obj if keep is None or i in keep else None), stat, None) 
+                for i, obj, stat in zip(group, objs, stats)]
+    except Exception:
+        return [(None, None, traceback.format_exc())] * len(group)
+
+
+def _run_pool(context, workers, shared, groups):
+    # runs the groups in worker processes, yields each group with its result as it is read
+    # a worker process dying (killed, crashed) breaks the pool: the groups not finished are
+    # run again each in a process of its own, so the group that kills its process fails alone
+    # and the others still return
+    broken = list()
+    with ProcessPoolExecutor(workers, mp_context=context, 
+                             initializer=_init_worker, initargs=(shared,)) as pool:
+        futures = [pool.submit(_run_task, group) for group in groups]
+        for group, future in zip(groups, futures):
+            try:
+                yield group, future.result()
+            except BrokenProcessPool:
+                broken.append(group)
+
+    for start in range(0, len(broken), workers):
+        chunk = broken[start:start + workers]
+        pools = [ProcessPoolExecutor(1, mp_context=context, initializer=_init_worker, initargs=(shared,))
+                 for group in chunk]
+        try:
+            futures = [pool.submit(_run_task, group) for pool, group in zip(pools, chunk)]
+            for group, future in zip(chunk, futures):
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    result = [(None, None, traceback.format_exc())] * len(group)
+                yield group, result
+        finally:
+            for pool in pools:
+                pool.shutdown()
+
+
+def run_simulations(amago, data_obj, series, simulations, schedule=None, workers=1, share=False,
+                    keep=None, summarize=False, batch=False, resume=False):
+    # runs the simulations (complete parameters) and returns a (backtest, summary, error)
+    # for each one, in order
+    # keep: indexes of the simulations saved and returned (default all)
+    # summarize: calculates the summary statistics of each simulation
+    # batch: runs the simulations differing only in BATCHED parameters together (a failure
+    # fails the whole batch)
+    # resume: continues the simulations from their checkpoints (one by one)
+    if batch and not resume:
+        groups = dict()
+        for i, params in enumerate(simulations):
+            groups.setdefault(batch_key(params), []).append(i)
+        groups = list(groups.values())
+    else:
+        groups = [[i] for i in range(len(simulations))]
+    workers = min(workers, len(groups))
+
+    shared = (amago, data_obj, series, schedule, simulations, keep, summarize, resume)
+    published = None
+    if workers > 1:
+        if "fork" in mp.get_all_start_methods():
+            context = mp.get_context("fork")
+        else:
+            context = mp.get_context()
+            share = True
+        if share:
+            published = data_obj.share()
+            shared = (amago, (type(data_obj), published.descriptor)) + shared[2:]
+        results = _run_pool(context, workers, shared, groups)
+    else:
+        _init_worker(shared)
+        results = zip(groups, map(_run_task, groups))
+
+    outputs = [None] * len(simulations)
+    try:
+        for group, result in results:
+            for i, (obj, stats, error) in zip(group, result):
+                name = simulations[i]["name"]
+                if error is None:
+                    if obj is not None:
+                        obj.add_data(data_obj)
+                        obj.add_series(series)
+                    print("Done!", name)
+                else:
+                    print("Failed!", name)
+                    print(error)
+                outputs[i] = (obj, stats, error)
+    finally:
+        if workers > 1:
+            results.close()
+        else:
+            _init_worker(None)
+        if published is not None:
+            published.close()
+    return outputs
+
+
+def run(amago, data_obj, series, config="config.json", test=False, schedule=None, workers=None,
+        share=False, batch=False, resume=False):
+    # schedule: overrides the schedule of amago, shared (and compiled once per calendar)
+    # by all the simulations
+    # workers: number of processes running simulations in parallel (default: config
+    # "workers" or 1). The data is inherited by the workers when they are forked
+    # share: publishes the data once into memory-mapped files, attached by the workers
+    # without copies (always done on platforms without fork)
+    # batch: simulations differing only in the BATCHED parameters (name, targets, commission,
+    # fund fees and start cash) run together in one calendar loop (see BatchBacktest)
+    # resume: simulations saved before continue from their checkpoints over the new dates
+    # of the data, appending to their results
     print("Loading:", config)
     with open(config, "r") as file:
         config_data = json.load(file)
 
     default = config_data["default"]
-    simulations = config_data["simulations"]
-
-    objs = list()
-    for simulation in simulations:
-        print("Starting simulation:", simulation["name"])
+    simulations = list()
+    for simulation in config_data["simulations"]:
         params = default.copy()
         params.update(simulation)
+        simulations.append(params)
+
+    if workers is None:
+        workers = config_data.get("workers", 1)
 
-        obj = amago(**params)
-        obj.add_data(data_obj)
-        obj.add_series(series)
+    # results in config order, failed simulations are None
+    outputs = run_simulations(amago, data_obj, series, simulations, schedule, workers, share, 
+                              batch=batch, resume=resume)
+    objs = [obj for obj, stats, error in outputs]
 
-        run_simulation(obj)
-        objs.append(obj)
-        print("Done!", obj.name)
-    
-    return objs[0] if test else objs
+    if test:
+        if objs[0] is None:
+            raise RuntimeError("Simulation failed: {}".format(simulations[0]["name"]))
+        return objs[0]
+    return objs
@@ -0,0 +1,116 @@
+import numpy as np
+
+
+class Rule:
+    """
+    A class to represent a rule of a schedule.
+
+    Rules are compiled into a boolean array over a calendar, True on the
+    days in which the rule triggers.
+    """
+
+    def compile(self, calendar):
+        raise NotImplementedError("Must override compile")
+
+
+
+class FirstDay(Rule):
+    """Triggers on the first day of the calendar, or **offset** days after it"""
+
+    def __init__(self, offset=0):
+        self.offset = offset
+
+    def compile(self, calendar):
+        triggers = np.zeros(calendar.size, dtype=bool)
+        if self.offset < calendar.size:
+            triggers[self.offset] = True
+        return triggers
+
+
+
+class Weekly(Rule):
+    """Triggers on the first day of each week"""
+
+    def compile(self, calendar):
+        week = calendar.isocalendar().week.values
+        triggers = np.zeros(calendar.size, dtype=bool)
+        triggers[1:] = week[1:] != week[:-1]
+        return triggers
+
+
+
+class MonthStart(Rule):
+    """Triggers on the first day of each month"""
+
+    def compile(self, calendar):
+        month = calendar.month.values
+        triggers = np.zeros(calendar.size, dtype=bool)
+        triggers[1:] = month[1:] != month[:-1]
+        return triggers
+
+
+
+class Anniversary(Rule):
+    """Triggers on the first day on or after a fixed month/day, every year"""
+
+    def __init__(self, month, day):
+        self.month = month
+        self.day = day
+
+    def compile(self, calendar):
+        month_day = calendar.month.values * 100 + calendar.day.values
+        anniversary = self.month * 100 + self.day
+        triggers = np.zeros(calendar.size, dtype=bool)
+        triggers[1:] = (month_day[:-1] < anniversary) & (month_day[1:] >= anniversary)
+        return triggers
+
+
+
+class EveryNDays(Rule):
+    """Triggers every **n** business days of the calendar, starting at **offset**"""
+
+    def __init__(self, n, offset=0):
+        self.n = n
+        self.offset = offset
+
+    def compile(self, calendar):
+        day = np.arange(calendar.size) - self.offset
+        return (day >= 0) & (day % self.n == 0)
+
+
+
+class Schedule:
+    """
+    A class to represent a schedule of strategy triggers.
+
+    The schedule triggers on the days in which any of its rules triggers.
+    Compiled schedules are kept by calendar, so a schedule shared by several
+    simulations (e.g. as a class attribute of a Backtest) is compiled only
+    once for each calendar.
+
+
+    Attributes
+    ----------
+    rules : list
+        rules of the schedule
+
+    Methods
+    -------
+    compile(calendar):
+        Returns the boolean trigger array over the calendar
+    """
+
+    def __init__(self, *rules):
+        self.rules = list(rules)
+        self.__compiled = dict()
+
+
+    def compile(self, calendar):
+        key = (calendar[0], calendar[-1], calendar.size) if calendar.size else None
+        if key not in self.__compiled:
+            triggers = np.zeros(calendar.size, dtype=bool)
+            for rule in self.rules:
+                triggers |= rule.compile(calendar)
+            triggers.flags.writeable = False
+            self.__compiled[key] = triggers
+        return self.__compiled[key]
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+class SharedLines:
+    """
+    A class to publish data lines once, to be read by other processes.
+
+    The values of each numeric line are written once to a memory-mapped
+    .npy file. The **descriptor** (files, indexes and columns) is light to
+    pickle, and **attach** rebuilds read-only DataFrames over the mapped
+    files without copying them. Every process attached shares the same
+    pages of the OS page cache, so memory stays flat as processes are added.
+    Non-numeric lines are sent in the descriptor as they are.
+
+
+    Attributes
+    ----------
+    path : str
+        directory of the memory-mapped files
+    descriptor : dict
+        information to attach to the lines
+
+    Methods
+    -------
+    attach(descriptor, mmap_mode="r"):
+        Returns the lines, read-only, over the memory-mapped files
+    close():
+        Removes the memory-mapped files
+    """
+
+    def __init__(self, lines, path=None):
+        # path: parent directory of the files (e.g. /dev/shm), default the temporary directory
+        self.path = tempfile.mkdtemp(prefix="backtest_", dir=path)
+        self.descriptor = {"lines": dict()}
+
+        for i, (name, line) in enumerate(lines.items()):
+            entry = {"index": line.index, "columns": getattr(line, "columns", None),
+                     "name": getattr(line, "name", None)}
+            values = line.values
+            if values.dtype.kind not in "biuf":
+                entry["line"] = line
+            else:
+                entry["file"] = os.path.join(self.path, "{}.npy".format(i))
+                array = np.lib.format.open_memmap(entry["file"], mode="w+",
+                                                  dtype=values.dtype, shape=values.shape)
+                array[...] = values
+                array.flush()
+                del array
+            self.descriptor["lines"][name] = entry
+
+
+    @staticmethod
+    def attach(descriptor, mmap_mode="r"):
+        # mmap_mode=None reads the files into memory
+        lines = dict()
+        for name, entry in descriptor["lines"].items():
+            if "line" in entry:
+                lines[name] = entry["line"]
+                continue
+            values = np.load(entry["file"], mmap_mode=mmap_mode)
+            if values.ndim == 1:
+                lines[name] = pd.Series(values, index=entry["index"], name=entry["name"], copy=False)
+            else:
+                lines[name] = pd.DataFrame(values, index=entry["index"], columns=entry["columns"], copy=False)
+        return lines
+
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
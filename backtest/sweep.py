@@ -0,0 +1,151 @@
+import json
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from .run import run_simulations
+
+
+def expand(spec, default=None):
+    """Expands a sweep specification into simulations
+
+    The specification combines any of:
+
+    - "grid": {parameter: [values]}, the Cartesian product of the values
+    - "list": [{parameter: value}], explicit points
+    - "random": {"samples": n, "seed": seed, "params": {parameter: values}},
+      n points sampled from a list of values or uniformly from
+      {"low": low, "high": high} (integers if both bounds are integers)
+
+    Points are applied over **default** and the fixed parameters of
+    spec["base"]. Points with identical parameters
+    are run only once. Points without a "name" are named after
+    spec["name"] (default "sweep") and their order.
+
+    Parameters
+    ----------
+    spec : dict
+        Sweep specification
+    default : dict, default : None
+        Default parameters of the simulations
+
+    Returns
+    -------
+    list
+        Parameters of each simulation
+    """
+    points = list()
+
+    grid = spec.get("grid", dict())
+    if grid:
+        names = list(grid)
+        for values in itertools.product(*[grid[name] for name in names]):
+            points.append(dict(zip(names, values)))
+
+    points += [dict(point) for point in spec.get("list", [])]
+
+    if "random" in spec:
+        random = spec["random"]
+        rng = np.random.default_rng(random.get("seed"))
+        for _ in range(random["samples"]):
+            point = dict()
+            for name, values in random["params"].items():
+                if isinstance(values, dict):
+                    low, high = values["low"], values["high"]
+                    if isinstance(low, int) and isinstance(high, int):
+                        point[name] = int(rng.integers(low, high, endpoint=True))
+                    else:
+                        point[name] = float(rng.uniform(low, high))
+                else:
+                    point[name] = values[rng.integers(len(values))]
+            points.append(point)
+
+    prefix = spec.get("name", "sweep")
+    simulations = list()
+    seen = set()
+    for point in points:
+        params = dict(default or dict())
+        params.update(spec.get("base", dict()))
+        params.update(point)
+        key = tuple(sorted((name, repr(value)) for name, value in params.items() if name != "name"))
+        if key in seen:
+            continue
+        seen.add(key)
+        if "name" not in point:
+            params["name"] = "{}_{:03d}".format(prefix, len(simulations))
+        simulations.append(params)
+    return simulations
+
+
+def sweep(amago, data_obj, series, spec=None, config="config.json", select=None,
+          schedule=None, workers=None, share=False, batch=False):
+    """Runs a parameter sweep
+
+    Parameters
+    ----------
+    amago : type
+        Backtest class
+    data_obj : CSVData
+        Data of the simulations
+    series : dict
+        Series of the simulations
+    spec : dict, default : None
+        Sweep specification (see **expand**), default config "sweep"
+    config : str, default : "config.json"
+        Config file, with the default parameters
+    select : iterable or callable, default : None
+        Names of the simulations (or a function of their parameters returning
+        True) whose full results are saved and returned
+    schedule : Schedule, default : None
+        Schedule overriding the schedule of **amago**
+    workers : int, default : None
+        Number of worker processes, default config "workers" or 1
+    share : boolean, default : False
+        Publishes the data into memory-mapped files for the workers
+    batch : boolean, default : False
+        Runs the points differing only in the batched parameters (targets,
+        commission, fund fees and start cash) together, see BatchBacktest
+
+    Returns
+    -------
+    pandas.DataFrame
+        Swept parameters and statistics of each simulation, with "name" as
+        index (statistics are missing for failed simulations)
+    dict
+        Backtests of the selected simulations, by name
+    """
+    with open(config, "r") as file:
+        config_data = json.load(file)
+    spec = spec if spec is not None else config_data["sweep"]
+    if workers is None:
+        workers = config_data.get("workers", 1)
+
+    simulations = expand(spec, config_data["default"])
+
+    if select is None:
+        keep = set()
+    elif callable(select):
+        keep = {i for i, params in enumerate(simulations) if select(params)}
+    else:
+        names = set(select)
+        keep = {i for i, params in enumerate(simulations) if params["name"] in names}
+
+    outputs = run_simulations(amago, data_obj, series, simulations, schedule, workers, share,
+                              keep=keep, summarize=True, batch=batch)
+
+    # parameters which vary across the simulations
+    names = dict.fromkeys(name for params in simulations for name in params if name != "name")
+    swept = [name for name in names if len({repr(params.get(name)) for params in simulations}) > 1]
+    rows = list()
+    selected = dict()
+    for params, (obj, stats, error) in zip(simulations, outputs):
+        row = {"name": params["name"]}
+        row.update({name: params.get(name) for name in swept})
+        row.update(stats or dict())
+        rows.append(row)
+        if obj is not None:
+            selected[params["name"]] = obj
+
+    table = pd.DataFrame(rows).set_index("name")
+    return table, selected
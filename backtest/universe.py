@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+
+def share_class_leaders(volume, prefix=4):
+    """Finds the most liquid share class of each company
+
+    Tickers sharing the first **prefix** characters are share classes of
+    the same company. On each date only the class with the largest volume
+    is kept (the last one, in column order, on ties or when the volume of
+    every class is missing).
+
+    Parameters
+    ----------
+    volume : pandas.DataFrame
+        Volume with "date" as index and tickers as columns
+    prefix : int, default : 4
+        Number of characters of the ticker identifying the company
+
+    Returns
+    -------
+    pandas.DataFrame
+        Boolean mask with the same index and columns of **volume**
+    """
+    companies = np.array([ticker[0:prefix] for ticker in volume.columns])
+    order = np.argsort(companies, kind="stable")
+    starts = np.flatnonzero(np.r_[True, companies[order][1:] != companies[order][:-1]])
+    company = np.repeat(np.arange(starts.size), np.diff(np.r_[starts, order.size]))
+
+    values = volume.values[:, order].astype(np.float64)
+    values = np.where(np.isnan(values), -np.inf, values)
+    leader = values == np.maximum.reduceat(values, starts, axis=1)[:, company]
+
+    # last leading column of each company
+    columns = np.where(leader, np.arange(order.size), -1)
+    last = np.maximum.reduceat(columns, starts, axis=1)
+
+    mask = np.zeros(volume.shape, dtype=bool)
+    mask[np.arange(volume.shape[0])[:, None], order[last]] = True
+    return pd.DataFrame(index=volume.index, columns=volume.columns, data=mask)
+
+
+def eligibility(volume, floor, excluded=(), prefix=4):
+    """Builds the universe eligibility mask
+
+    A ticker is eligible on a date when it is the most liquid share class
+    of its company, its volume is above **floor** and it is not excluded.
+
+    Parameters
+    ----------
+    volume : pandas.DataFrame
+        Volume (e.g. average volume) with "date" as index and tickers as columns
+    floor : float
+        Minimum volume
+    excluded : iterable, default : ()
+        Tickers excluded from the universe
+    prefix : int, default : 4
+        Number of characters of the ticker identifying the company
+
+    Returns
+    -------
+    pandas.DataFrame
+        Boolean mask with the same index and columns of **volume**
+    """
+    excluded = set(excluded)
+    allowed = np.array([ticker not in excluded for ticker in volume.columns], dtype=bool)
+    mask = share_class_leaders(volume, prefix).values
+    mask &= volume.values > floor
+    mask &= allowed
+    return pd.DataFrame(index=volume.index, columns=volume.columns, data=mask)
+
+
+def sector_weights(weights, sectors):
+    """Aggregates market weights by sector
+
+    Only positive weights of tickers with a sector are summed.
+
+    Parameters
+    ----------
+    weights : pandas.DataFrame
+        Market weights with "date" as index and tickers as columns
+    sectors : pandas.Series
+        Sector of each ticker
+
+    Returns
+    -------
+    pandas.DataFrame
+        Weights with "date" as index and sectors as columns
+    """
+    codes, names = pd.factorize(sectors.reindex(weights.columns))
+    values = weights.values
+    rows, columns = np.nonzero((values > 0) & (codes >= 0))
+    totals = np.bincount(rows * len(names) + codes[columns], weights=values[rows, columns],
+                         minlength=values.shape[0] * len(names))
+    return pd.DataFrame(index=weights.index, columns=names, 
+                        data=totals.reshape(values.shape[0], len(names)))
@@ -4,6 +4,9 @@ from backtest.data import CSVData, RiskFree, MarketIndex, Fund, ingest_series
 from backtest.data import ingest_data, get_series, get_fund
 from backtest.run import run
 from backtest.analysis import Analytics
+from backtest.schedule import Schedule, FirstDay, Weekly, Anniversary
+from backtest.universe import eligibility, sector_weights
+from backtest.ranking import rank, leaders
 import datetime as dt
 
 import pandas as pd
@@ -20,37 +23,52 @@ REBALANCE_DATES = [
 AVERAGE_VOLUME_ROLLING_WINDOW = 63
 MINIMUM_AVERAGE_VOLUME = 10000000
 
+NUMBER_FINANCIALS = 4
+NUMBER_REALESTATE = 1
+
 
 class Amago(Backtest):
 
     def calculate_support_index(self):
-        average_volume = self.volume.rolling(AVERAGE_VOLUME_ROLLING_WINDOW).mean()
+        # computed once and shared by all simulations
+        average_volume = self.data.indicator("volume", "mean", AVERAGE_VOLUME_ROLLING_WINDOW)
         self.average_volume = average_volume
+        self.eligible = eligibility(average_volume, MINIMUM_AVERAGE_VOLUME, EXCLUDED)
+
+        # long and short candidates of every rebalance date, ranked at once
+        dates = self.calendar[self.triggers]
+        tickers = average_volume.columns
+        long, short = rank(self.recommendations.reindex(index=dates, columns=tickers).values,
+                           self.score.reindex(index=dates, columns=tickers).values,
+                           average_volume.reindex(dates).values,
+                           self.eligible.reindex(dates).values,
+                           self.number_long - NUMBER_FINANCIALS - NUMBER_REALESTATE,
+                           self.number_short)
+        self.ranking = {date: ([tickers[i] for i in long[row] if i >= 0], 
+                               [tickers[i] for i in short[row] if i >= 0])
+                        for row, date in enumerate(dates)}
+
+        # sector weights of the market portfolio and the most liquid names of the 
+        # allocated sectors, for all dates
+        sectors = self.sectors.amago_sector
+        self.mkt_portfolio_sectors = sector_weights(self.mkt_portfolio, sectors)
+
+        tickers = self.mkt_portfolio.columns
+        weights = self.mkt_portfolio.values
+        volume = average_volume.reindex(index=self.calendar, columns=tickers).values
+        self.sector_leaders = dict()
+        for sector, number in [("Financials", NUMBER_FINANCIALS), ("Real Estate", NUMBER_REALESTATE)]:
+            selected = (weights > 0) & (sectors.reindex(tickers) == sector).values
+            self.sector_leaders[sector] = leaders(volume, selected, number)
+
+
+    # rebalances on the first day, on each new week and on the rebalance dates
+    schedule = Schedule(FirstDay(1), Weekly(),
+                        *[Anniversary(date.month, date.day) for date in REBALANCE_DATES])
 
-        tmp = self.mkt_portfolio.copy()
-        tmp = tmp.T
-        tmp.loc[:,"sector"] = self.sectors.amago_sector.reindex(tmp.index)
-        tmp = tmp.groupby("sector").sum().T
-        tmp.index = pd.to_datetime(tmp.index)
-        tmp = tmp.reindex(self.calendar)
-        self.mkt_portfolio_sectors = tmp
-
-
-    def check_rebalance(self):
-        current_date = dt.date(1904, self.date.month, self.date.day)
-        previous_date = dt.date(1904, self.previous_date.month, self.previous_date.day)
-        for rebalance_date in REBALANCE_DATES:
-            if previous_date < rebalance_date and current_date >= rebalance_date:
-                return True
-        return False
-    
-    
     def open_strategy(self):
         # _open_strategy: calculates orders to be entered in opening auction
-        c1 = self.day==1
-        c2 = self.check_rebalance()
-        c3 = self.date.week != self.previous_date.week
-        if c1 or c2 or c3:
+        if self.trigger:
             long, short = self.strategy()
             self.allocate(long, short)
             
@@ -60,25 +78,18 @@ class Amago(Backtest):
 
     def strategy(self):
         # First lets allocate Financials and Real Estate
-        number_financials = 4
-        number_realestate = 1
-
-        mkt_port = self.mkt_portfolio.loc[self.date]
-        mkt_port = mkt_port[mkt_port>0]
-        mkt_port.name = "share"
-        sector = self.sectors.reindex(mkt_port.index).amago_sector
-        vol = self.average_volume.loc[self.date].reindex(mkt_port.index)
-        vol.name = "volume"
-        df = pd.concat([mkt_port, sector, vol], axis=1).sort_values("volume", ascending=False)
-
-        target_financials = df.groupby("amago_sector").sum().loc["Financials"].share
+        number_financials = NUMBER_FINANCIALS
+        number_realestate = NUMBER_REALESTATE
+
+        target_financials = self.mkt_portfolio_sectors["Financials"].iat[self.day]
         pct_financials = target_financials / number_financials
 
-        target_realestate = df.groupby("amago_sector").sum().loc["Real Estate"].share
+        target_realestate = self.mkt_portfolio_sectors["Real Estate"].iat[self.day]
         pct_realestate = target_realestate / number_realestate
 
-        long_financials = list(df[df["amago_sector"]=="Financials"].index)[0:number_financials]
-        long_realestate = list(df[df["amago_sector"]=="Real Estate"].index)[0:number_realestate]
+        tickers = self.mkt_portfolio.columns
+        long_financials = [tickers[i] for i in self.sector_leaders["Financials"][self.day] if i >= 0]
+        long_realestate = [tickers[i] for i in self.sector_leaders["Real Estate"][self.day] if i >= 0]
 
         long = [(long,pct_financials) for long in long_financials]
         long += [(long,pct_realestate) for long in long_realestate]
@@ -90,42 +101,16 @@ class Amago(Backtest):
         percentage_long = (self.target_long - target_financials - target_realestate) / number_long
         percentage_short = -self.target_short / number_short
 
-        # Now lets allocate the rest of the portfolio
-        recom = self.recommendations.loc[self.date]
-        recom.name = "recommendation"
-        score = self.score.loc[self.date]
-        score.name = "score"
-        vol = self.average_volume.loc[self.date]
-        vol.name = "volume"
-        df = pd.concat([recom, score, vol], axis=1)
-
-        # Get only the most liquid security for each company
-        df["asset"] = df.index.str[0:4]
-        df = df.sort_values("volume", na_position="first").reset_index()
-        df = df.groupby("asset").tail(1).set_index("ticker")
-
-        # get long
-        df = df.sort_values(["recommendation", "score", "volume"], ascending=[False, False, False])
-        df_filter = df[df["volume"] > MINIMUM_AVERAGE_VOLUME]
-        long_tickers = [ticker for ticker in df_filter.index]
-        # excludes restricted sectors
-        long_tickers = [ticker for ticker in long_tickers if ticker not in EXCLUDED]
-        long_tickers = long_tickers[0:number_long]
+        # Now lets allocate the rest of the portfolio, from the ranked eligible universe
+        long_tickers, short_tickers = self.ranking[self.date]
         long += [(ticker,percentage_long) for ticker in long_tickers]
-
-        # get short
-        df = df.sort_values(["recommendation", "score", "volume"], ascending=[True, True, False])
-        df_filter = df[(df["volume"] > MINIMUM_AVERAGE_VOLUME) & (df["recommendation"]==-1)]
-        short_tickers = [ticker for ticker in df_filter.index if ticker not in long_tickers]
-        # excludes restricted sectors
-        short_tickers = [ticker for ticker in short_tickers if ticker not in EXCLUDED]
-        short_tickers = short_tickers[0:number_short]
         short += [(ticker,percentage_short) for ticker in short_tickers]
 
         return long, short
 
 
-data = ingest_data(config="config.json", data=CSVData)
-series = ingest_series(config="config.json")
+if __name__ == "__main__":
+    data = ingest_data(config="config.json", data=CSVData)
+    series = ingest_series(config="config.json")
 
-backtest = run(amago=Amago, data_obj=data, series=series, config="config.json", test=True)
\ No newline at end of file
+    backtest = run(amago=Amago, data_obj=data, series=series, config="config.json", test=True)
\ No newline at end of file
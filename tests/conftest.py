@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package creates its data directories relative to the working directory on import, 
+# so the tests run from a scratch directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="backtest-tests-"))
+os.mkdir("data")
+
+
+
+@pytest.fixture
+def assets(tmp_path):
+    # small asset files, with a line no strategy uses
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range("2020-01-01", "2020-03-31")
+    for ticker in ("AAAA3", "BBBB3", "CCCC4"):
+        close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, len(dates))))
+        df = pd.DataFrame({"date": dates.strftime("%Y-%m-%d"), 
+                           "open": close * np.exp(rng.normal(0, 0.005, len(dates))),
+                           "close": close, 
+                           "volume": rng.lognormal(16, 1, len(dates)),
+                           "unused": rng.normal(0, 1, len(dates))})
+        df.to_csv(tmp_path / "{}.csv".format(ticker), index=False)
+    return str(tmp_path)
+
+
+@pytest.fixture
+def market():
+    # sectors and market portfolio of the asset files
+    from backtest.definitions import SECTORS, MKT_PORTFOLIO
+    tickers = ["AAAA3", "BBBB3", "CCCC4"]
+    calendar = pd.bdate_range("2020-01-01", "2020-03-31")
+    pd.DataFrame({"ticker": tickers, "amago_sector": ["Financials"] * 3}).to_csv(SECTORS, index=False)
+    portfolio = pd.DataFrame(1 / 3, index=calendar, columns=tickers)
+    portfolio.index.name = "date"
+    portfolio.to_csv(MKT_PORTFOLIO)
@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest.backtest import Backtest
+from backtest.batch import BatchBacktest
+from backtest.data import CSVData
+
+
+
+class Strategy(Backtest):
+
+    def open_strategy(self):
+        if self.trigger:
+            self.allocate([("AAAA3", 0.5)], [("BBBB3", 0.25)])
+
+    def close_strategy(self):
+        pass
+
+
+
+class CountingStrategy(Strategy):
+
+    def _execute_orders(self, auction):
+        self.auctions = getattr(self, "auctions", 0) + 1
+        super()._execute_orders(auction)
+
+
+
+def create(assets, mmap=False, share=False, cls=Strategy, name="backtest", commission=0.001):
+    data = CSVData(assets, "2020-01-01", "2020-03-31", mmap=mmap)
+    data.load()
+    if share:
+        data = CSVData.attach(data.share(".").descriptor)
+    calendar = pd.bdate_range("2020-01-01", "2020-03-31")
+    series = {"risk_free_rate": SimpleNamespace(series=pd.Series(0.0001, index=calendar))}
+
+    backtest = cls("2020-01-01", "2020-03-31", number_long=1, number_short=1,
+                   target_long=0.5, target_short=0.25, volume_floor=0, 
+                   pct_cdi=1, commission=commission, name=name)
+    backtest.add_data(data)
+    backtest.add_series(series)
+    backtest.set_calendar()
+    return backtest, data
+
+
+def test_run_aligns_only_the_lines_it_reads(assets):
+    backtest, data = create(assets)
+    backtest.run()
+
+    assert sorted(backtest.arrays) == ["cash_fund_nav", "close", "open"]
+    assert backtest.ledger.frame("value").iloc[-1, 0] > 0
+
+
+def test_other_lines_are_aligned_on_first_access(assets):
+    backtest, data = create(assets)
+    backtest.run()
+
+    volume = data.volume.reindex(index=backtest.calendar, columns=backtest.tickers)
+    np.testing.assert_array_equal(backtest.arrays["volume"], volume.values)
+    with pytest.raises(KeyError):
+        backtest.arrays["missing"]
+
+
+@pytest.mark.parametrize("mmap, share", [(True, False), (False, True)])
+def test_run_leaves_unused_lines_unopened(assets, mmap, share):
+    backtest, data = create(assets, mmap=mmap, share=share)
+    backtest.run()
+
+    opened = data._CSVData__lines
+    assert "open" in opened and "close" in opened
+    assert "unused" not in opened
+    assert backtest.unused.shape == data.close.shape
+
+
+def test_batch_matches_the_backtests_run_alone(assets, market):
+    commissions = [0.001, 0.01]
+    alone = [create(assets, name=str(c), commission=c)[0] for c in commissions]
+    for backtest in alone:
+        backtest.run()
+    batch = [create(assets, name=str(c), commission=c)[0] for c in commissions]
+    BatchBacktest(batch).run()
+
+    for a, b in zip(alone, batch):
+        pd.testing.assert_frame_equal(a.value, b.value)
+        pd.testing.assert_frame_equal(a.position, b.position)
+        pd.testing.assert_frame_equal(a.orders, b.orders)
+        pd.testing.assert_frame_equal(a.expenses, b.expenses)
+    assert not alone[0].value.equals(alone[1].value)
+
+
+def test_batch_runs_the_routines_of_the_backtest_class(assets, market):
+    batch = [create(assets, cls=CountingStrategy, name=name)[0] for name in ("a", "b")]
+    BatchBacktest(batch).run()
+
+    assert batch[0].auctions > 0
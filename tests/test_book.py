@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+
+from backtest.book import BatchOrderBook
+
+
+
+def test_pending_quantities_sum_the_orders_of_the_day():
+    calendar = pd.bdate_range("2020-01-01", "2020-01-31")
+    book = BatchOrderBook(calendar, ticker=["AAAA3", "BBBB3", "CCCC4", "CASH_FUND"])
+    book.register(3, "open", 4, portfolio=np.array([0, 0, 1, 2]), ticker=np.array([0, 0, 1, 2]),
+                  quantity=np.array([100.0, 50.0, np.nan, -20.0]))
+    book.register(3, "close", 1, portfolio=np.array([1]), ticker=np.array([2]), 
+                  quantity=np.array([30.0]))
+    book.register(4, "open", 1, portfolio=np.array([0]), ticker=np.array([0]), 
+                  quantity=np.array([1000.0]))
+    book.fill(np.array([3]), price=10.0)
+
+    portfolios = np.array([0, 1, 2])
+    tickers = np.array([2, 0, 0])
+    expected = np.array([[0.0, 150.0, 150.0],
+                         [30.0, 0.0, 0.0],
+                         [0.0, 0.0, 0.0]])
+    np.testing.assert_array_equal(book.pending_quantities(3, portfolios, tickers), expected)
+    np.testing.assert_array_equal(book.pending_quantities(5, portfolios, tickers), np.zeros((3, 3)))
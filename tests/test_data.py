@@ -0,0 +1,30 @@
+import pickle
+
+import pandas as pd
+import pytest
+
+from backtest.data import CSVData
+
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_csv_data_pickle_round_trip(assets, mmap):
+    data = CSVData(assets, "2020-01-01", "2020-03-31", mmap=mmap)
+    data.load()
+
+    copy = pickle.loads(pickle.dumps(data))
+
+    assert copy.tickers == data.tickers
+    assert copy.fingerprint == data.fingerprint
+    for name, line in data.get_lines().items():
+        pd.testing.assert_frame_equal(getattr(copy, name), line)
+
+
+def test_csv_data_private_names_are_not_lines(assets):
+    data = CSVData(assets, "2020-01-01", "2020-03-31")
+    data.load()
+
+    with pytest.raises(AttributeError):
+        data.__missing_attribute
+    with pytest.raises(AttributeError):
+        data.missing_line
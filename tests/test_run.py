@@ -0,0 +1,42 @@
+import os
+import multiprocessing as mp
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from backtest.backtest import Backtest
+from backtest.data import CSVData
+from backtest.run import run_simulations
+
+
+
+class Strategy(Backtest):
+
+    def open_strategy(self):
+        if self.name == "exit":
+            os._exit(1)
+        if self.trigger:
+            self.allocate([("AAAA3", 0.5)], [("BBBB3", 0.25)])
+
+    def close_strategy(self):
+        pass
+
+
+
+@pytest.mark.skipif("fork" not in mp.get_all_start_methods(), reason="needs fork")
+def test_dead_worker_fails_only_its_simulation(assets, market):
+    data = CSVData(assets, "2020-01-01", "2020-03-31")
+    data.load()
+    calendar = pd.bdate_range("2020-01-01", "2020-03-31")
+    series = {"risk_free_rate": SimpleNamespace(series=pd.Series(0.0001, index=calendar))}
+    default = {"start": "2020-01-01", "end": "2020-03-31", "number_long": 1, "number_short": 1,
+               "target_long": 0.5, "target_short": 0.25, "volume_floor": 0, 
+               "pct_cdi": 1, "commission": 0.001}
+    simulations = [dict(default, name=name) for name in ("first", "exit", "last")]
+
+    outputs = run_simulations(Strategy, data, series, simulations, workers=2, keep=[], summarize=True)
+
+    assert [error is None for obj, stats, error in outputs] == [True, False, True]
+    assert "BrokenProcessPool" in outputs[1][2]
+    assert outputs[0][1] is not None and outputs[2][1] is not None